@@ -0,0 +1,100 @@
+"""
+Show how much memory the typed catalog schema saves on a large catalog.
+
+    python -m benchmarks.catalog_memory [master_inventory.xlsx] [--rows 200000]
+
+Without a file a synthetic catalog shaped like files/master_inventory.xlsx is
+generated, with every column held the way the untyped ingest left it.
+"""
+import argparse
+import random
+
+import pandas as pd
+
+from pfsh_parser.catalog_schema import (
+    CATALOG_DTYPES,
+    apply_catalog_schema,
+    catalog_memory_summary,
+    mib,
+)
+
+VENDORS = [f"VENDOR {i}" for i in range(400)]
+TYPES = ["Women", "Men", "Unisex", "Gift Set"]
+SIZES = ["1 oz", "1.7 oz", "3.4 oz", "4.2 oz", "6.7 oz"]
+COUNTRIES = ["FR", "US", "IT", "ES", "GB", "AE", "DE"]
+
+
+def build_sample_catalog(rows):
+    return pd.DataFrame(
+        {
+            "Metafield: custom.item_number [single_line_text_field]": [
+                str(10000000 + i) for i in range(rows)
+            ],
+            "Title": [f"Product {i} Eau de Parfum" for i in range(rows)],
+            "Vendor": [random.choice(VENDORS) for _ in range(rows)],
+            "Type": [random.choice(TYPES) for _ in range(rows)],
+            "Option1 Name": ["Size"] * rows,
+            "Option1 Value": [random.choice(SIZES) for _ in range(rows)],
+            "Variant Country of Origin": [
+                random.choice(COUNTRIES) for _ in range(rows)
+            ],
+            "Variant SKU [ID]": [float(3760000000000 + i) for i in range(rows)],
+            "Variant Barcode": [float(3000000000000 + i) for i in range(rows)],
+            "Variant Inventory Qty": [
+                float(random.randint(0, 500)) for _ in range(rows)
+            ],
+            "Metafield: custom.length [number_integer]": [
+                float(random.randint(1, 12)) for _ in range(rows)
+            ],
+            "Metafield: custom.width [number_integer]": [
+                float(random.randint(1, 12)) for _ in range(rows)
+            ],
+            "Metafield: custom.height [number_integer]": [
+                float(random.randint(1, 12)) for _ in range(rows)
+            ],
+            "Metafield: custom.year [number_integer]": [
+                float(random.randint(1980, 2024)) for _ in range(rows)
+            ],
+            "Variant Price": [round(random.uniform(5, 300), 2) for _ in range(rows)],
+            "Variant Cost": [round(random.uniform(2, 150), 2) for _ in range(rows)],
+        },
+        dtype="object",
+    )
+
+
+def catalog_memory_report(before, after):
+    """A table of how much memory each column uses before and after applying the schema."""
+    before_usage = before.memory_usage(deep=True, index=False)
+    after_usage = after.memory_usage(deep=True, index=False)
+    lines = [f"{'column':<60} {'before':>10} {'after':>10}  dtype"]
+    for column in after.columns:
+        lines.append(
+            f"{str(column)[:60]:<60} {mib(before_usage.get(column, 0)):>10} "
+            f"{mib(after_usage[column]):>10}  {after[column].dtype}"
+        )
+    lines.append(f"{'TOTAL':<60} {catalog_memory_summary(before, after)}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("master_file", nargs="?")
+    parser.add_argument("--rows", type=int, default=200000)
+    args = parser.parse_args()
+
+    if args.master_file:
+        raw_df = pd.read_excel(args.master_file, engine="openpyxl", dtype="object")
+    else:
+        print(f"Generating {args.rows} row sample catalog")
+        raw_df = build_sample_catalog(args.rows)
+    typed_df = apply_catalog_schema(raw_df)
+
+    print(catalog_memory_report(raw_df, typed_df))
+    typed_columns = [column for column in typed_df.columns if column in CATALOG_DTYPES]
+    print(
+        f"{len(typed_columns)} of {len(typed_df.columns)} columns covered by the schema"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Compare the old and the new ShopifyClient transport against a local stand-in for the API.
+
+    python -m benchmarks.http_transport [--orders 250] [--requests 20]
+
+The stand-in serves synthetic orders shaped like the REST Admin API, honours
+the fields parameter and gzips the body when the client asks for it. Bytes are
+counted as sent on the wire, decode time covers only turning the body into
+Python objects. Request time over loopback mostly reflects the stand-in
+compressing the body, so bytes are the number to compare for a real shop.
+"""
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from pfsh_parser.shopify_engine import ORDER_FIELDS, ShopifyClient, orjson
+
+
+def build_order(order_id):
+    def address():
+        return {
+            "first_name": "Jane",
+            "last_name": "Doe",
+            "name": "Jane Doe",
+            "address1": f"{random.randint(1, 9999)} Main Street",
+            "address2": "Apt 4",
+            "city": "Springfield",
+            "province": "Illinois",
+            "province_code": "IL",
+            "country": "United States",
+            "country_code": "US",
+            "zip": "62704",
+            "phone": "555-0100",
+            "company": None,
+            "latitude": 39.78,
+            "longitude": -89.65,
+        }
+
+    line_items = [
+        {
+            "id": order_id * 10 + index,
+            "product_id": random.randint(10**12, 10**13),
+            "variant_id": random.randint(10**12, 10**13),
+            "sku": str(random.randint(10**11, 10**12)),
+            "title": f"Sample product {random.getrandbits(64):x} with a longer title",
+            "variant_title": "Default Title",
+            "vendor": "Sheralven",
+            "quantity": random.randint(1, 4),
+            "price": f"{random.uniform(5, 200):.2f}",
+            "grams": 450,
+            "requires_shipping": True,
+            "taxable": True,
+            "fulfillment_service": "manual",
+            "properties": [],
+            "tax_lines": [{"title": "State Tax", "rate": 0.0625, "price": "1.25"}],
+            "discount_allocations": [],
+            "price_set": {
+                "shop_money": {"amount": "19.99", "currency_code": "USD"},
+                "presentment_money": {"amount": "19.99", "currency_code": "USD"},
+            },
+        }
+        for index in range(random.randint(1, 5))
+    ]
+    return {
+        "id": order_id,
+        "name": f"#{order_id}",
+        "email": f"{random.getrandbits(40):x}@example.com",
+        "created_at": "2024-04-01T10:00:00-04:00",
+        "updated_at": "2024-04-01T10:05:00-04:00",
+        "financial_status": "paid",
+        "fulfillment_status": None,
+        "currency": "USD",
+        "total_price": "59.97",
+        "subtotal_price": "54.97",
+        "total_tax": "5.00",
+        "tags": "wholesale, priority",
+        "note": f"Please leave at the back door {random.getrandbits(96):x}",
+        "note_attributes": [{"name": "gift", "value": "no"}],
+        "browser_ip": "203.0.113.7",
+        "client_details": {"user_agent": "Mozilla/5.0 (X11; Linux x86_64)" * 3},
+        "customer": {
+            "id": order_id + 1,
+            "email": "jane@example.com",
+            "tags": "",
+            "default_address": address(),
+        },
+        "billing_address": address(),
+        "shipping_address": address(),
+        "shipping_lines": [
+            {"code": "UPS Ground", "price": "5.00", "title": "UPS Ground"}
+        ],
+        "tax_lines": [{"title": "State Tax", "rate": 0.0625, "price": "5.00"}],
+        "discount_codes": [],
+        "line_items": line_items,
+    }
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        orders = self.server.orders
+        if "fields" in query:
+            wanted = query["fields"][0].split(",")
+            orders = [
+                {key: order[key] for key in wanted if key in order} for order in orders
+            ]
+        body = json.dumps({"orders": orders}).encode()
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.bytes_sent += len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def old_client(base_url):
+    client = ShopifyClient("stand-in", "token")
+    client.base_url = base_url
+    # how the client used to set its headers - replacing the defaults, gzip included
+    client.session.headers = {
+        "X-Shopify-Access-Token": "token",
+        "Content-Type": "application/json",
+    }
+    return client
+
+
+def new_client(base_url):
+    client = ShopifyClient("stand-in", "token")
+    client.base_url = base_url
+    return client
+
+
+def run(server, client, uri, decode, requests):
+    server.bytes_sent = 0
+    decode_time = 0.0
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = client._get(uri)
+        decode_started = time.perf_counter()
+        decode(response.content)
+        decode_time += time.perf_counter() - decode_started
+    total = time.perf_counter() - started
+    return server.bytes_sent / requests, decode_time / requests, total / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=250)
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.orders = [build_order(1000 + index) for index in range(args.orders)]
+    server.bytes_sent = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    uri = "/admin/api/2024-04/orders.json?status=open"
+    fast_decode = orjson.loads if orjson is not None else json.loads
+    cases = (
+        ("before", old_client(base_url), uri, json.loads),
+        ("gzip", new_client(base_url), uri, json.loads),
+        (
+            "gzip+fields",
+            new_client(base_url),
+            f"{uri}&fields={ORDER_FIELDS}",
+            json.loads,
+        ),
+        ("after", new_client(base_url), f"{uri}&fields={ORDER_FIELDS}", fast_decode),
+    )
+    print(
+        f"{args.orders} orders per response, orjson {'installed' if orjson else 'not installed'}"
+    )
+    for name, client, case_uri, decode in cases:
+        wire, decode_time, total = run(server, client, case_uri, decode, args.requests)
+        print(
+            f"{name:>12}: {wire / 1024:8.1f} KiB on the wire  "
+            f"decode {decode_time * 1000:6.2f} ms  request {total * 1000:7.2f} ms"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
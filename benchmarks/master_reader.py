@@ -0,0 +1,89 @@
+"""
+Compare the streaming master sheet reader with the old full pd.read_excel load.
+
+    python -m benchmarks.master_reader [supplier_workbook.xlsx] [--rows 20000]
+
+Without a workbook a synthetic supplier file with the real headers (plus the
+unmapped columns Sheralven sends) is generated in files/tmp.
+"""
+import argparse
+import os
+import random
+import time
+import tracemalloc
+
+import openpyxl
+import pandas as pd
+
+from pfsh_parser.catalog_schema import CATALOG_DTYPES
+from pfsh_parser.xlsx_engine import MATRIXIFY_HEADER_MAP, read_projected_sheet
+
+
+def build_sample_workbook(path, rows):
+    workbook = openpyxl.Workbook(write_only=True)
+    workbook.create_sheet("Notes").append(["generated for benchmarking"])
+    sheet = workbook.create_sheet("Master")
+    extra = [f"Internal Note {i}" for i in range(10)] + [None] * 5
+    sheet.append(list(MATRIXIFY_HEADER_MAP) + extra)
+    for row in range(rows):
+        sheet.append(
+            [
+                f"{random.random():.6f}"
+                if header != "SHERALVEN UPC"
+                else 10**11 + row
+                for header in MATRIXIFY_HEADER_MAP
+            ]
+            + ["lorem ipsum dolor sit amet"] * 10
+            + [None] * 5
+        )
+    workbook.save(path)
+
+
+def old_reader(path):
+    df = pd.read_excel(path, engine="openpyxl", sheet_name=1)
+    df = df.rename(columns=MATRIXIFY_HEADER_MAP)
+    return df.loc[:, ~df.columns.str.contains("^Unnamed")]
+
+
+def new_reader(path):
+    return read_projected_sheet(
+        path, MATRIXIFY_HEADER_MAP, sheet_index=1, dtypes=CATALOG_DTYPES
+    )
+
+
+def measure(reader, path):
+    # time and memory are taken from separate runs as tracemalloc slows parsing down a lot
+    started = time.perf_counter()
+    df = reader(path)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    reader(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("workbook", nargs="?")
+    parser.add_argument("--rows", type=int, default=20000)
+    args = parser.parse_args()
+
+    path = args.workbook
+    if path is None:
+        path = "files/tmp/benchmark_supplier_master.xlsx"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        print(f"Generating {args.rows} row sample workbook at {path}")
+        build_sample_workbook(path, args.rows)
+
+    for name, reader in (("pd.read_excel", old_reader), ("streaming", new_reader)):
+        elapsed, peak, df = measure(reader, path)
+        frame_size = df.memory_usage(deep=True).sum()
+        print(
+            f"{name:>14}: {elapsed:7.2f}s  peak {peak / 2**20:8.1f} MiB  "
+            f"frame {frame_size / 2**20:7.1f} MiB  {df.shape[0]} rows x {df.shape[1]} cols"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import os
+import sys
+
+from pfsh_parser.pipelines import PIPELINES
+from pfsh_parser.tenant_engine import load_tenants, run_tenants
+
+# usage: python multi_tenant_update.py <inventory|orders|shipping>
+TENANTS_FILE = os.environ.get("TENANTS_FILE") or "tenants.json"
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS") or 4)
+# Shopify requests in flight across every tenant at once
+API_CONCURRENCY = int(os.environ.get("API_CONCURRENCY") or 4)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in PIPELINES:
+        raise SystemExit(f"usage: {sys.argv[0]} <{'|'.join(PIPELINES)}>")
+    report = run_tenants(
+        load_tenants(TENANTS_FILE),
+        sys.argv[1],
+        max_workers=MAX_WORKERS,
+        api_concurrency=API_CONCURRENCY,
+    )
+    for result in report["results"]:
+        print(
+            f"{result['tenant']}: {result['status']} in {result['duration']}s {result['details']}"
+        )
+        if result["error"]:
+            print(result["error"])
+    print(
+        f"{report['succeeded']}/{report['tenants']} tenants succeeded in {report['duration']}s"
+    )
+    if report["failed"]:
+        sys.exit(1)
@@ -0,0 +1,71 @@
+import signal
+
+from pfsh_parser.sftp_engine import sftp_connect
+from pfsh_parser.csv_engine import process_orders, close_mail_queue, ORDERS_OUTPUT_FILE
+from pfsh_parser.log_engine import LogEngine
+from pfsh_parser.order_writer import discard_order_output
+from pfsh_parser.shopify_engine import ShopifyClient
+from pfsh_parser.webhook_engine import OrderDaemon, OrderQueue
+
+from pfsh_parser.creds import (
+    PFSH_USERNAME,
+    PFSH_PASSWORD,
+    HOST,
+    LOG_FILE,
+    SHOP_NAME,
+    SHOPIFY_ACCESS_TOKEN,
+    SHOPIFY_WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+)
+
+username = PFSH_USERNAME
+password = PFSH_PASSWORD
+host = HOST
+
+logger = LogEngine(file_path=LOG_FILE)
+sh_client = ShopifyClient(SHOP_NAME, SHOPIFY_ACCESS_TOKEN)
+
+
+def process_batch(orders):
+    # a file left behind by an interrupted batch is resumed and sent with this one
+    report = process_orders(sh_client, orders)
+    if not report.rows:
+        # failed and deferred orders stay queued for another try
+        return report
+    # same file name the scheduled job uses - batches run one at a time on the
+    # daemon's loop, so uploads never overlap
+    logger.log(f"DAEMON: PUSH MODIFIED ORDERS FILE TO SFTP")
+    sftp_connect(
+        host=host,
+        port=22,
+        username=username,
+        password=password,
+        direction="push",
+        local_file=ORDERS_OUTPUT_FILE,
+        remote_file=f"Orders/POSTFORDERS.csv",
+    )
+    discard_order_output(ORDERS_OUTPUT_FILE)
+    return report
+
+
+if not SHOPIFY_WEBHOOK_SECRET:
+    raise Exception("SHOPIFY_WEBHOOK_SECRET IS REQUIRED TO RUN THE ORDER DAEMON")
+
+daemon = OrderDaemon(
+    sh_client,
+    process_batch,
+    secret=SHOPIFY_WEBHOOK_SECRET,
+    queue=OrderQueue(),
+    host=WEBHOOK_HOST,
+    port=WEBHOOK_PORT,
+)
+# service managers stop the daemon with SIGTERM - finish cleanly like on Ctrl+C
+signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+try:
+    daemon.serve_forever()
+except KeyboardInterrupt:
+    daemon.stop()
+finally:
+    # fraud alerts still waiting for their digest window go out before exiting
+    close_mail_queue()
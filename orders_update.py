@@ -1,41 +1,6 @@
-from pfsh_parser.sftp_engine import sftp_connect
-from pfsh_parser.csv_engine import order_parser
-from pfsh_parser.log_engine import LogEngine
+from pfsh_parser.pipelines import run_orders
+from pfsh_parser.tenant_engine import TenantConfig
 
-from pfsh_parser.creds import (
-    PFSH_USERNAME,
-    PFSH_PASSWORD,
-    HOST,
-    UPDATED_ORDERS_FILE,
-    LOG_FILE,
-    SHOP_NAME,
-    SHOPIFY_ACCESS_TOKEN,
-)
-
-import time
-import os
-
-username = PFSH_USERNAME
-password = PFSH_PASSWORD
-host = HOST
-log_file = LOG_FILE
-
-logger = LogEngine(file_path=log_file)
-logger.log(f"Fetching Orders from Shopify API")
-order_parser(SHOP_NAME, "open", SHOPIFY_ACCESS_TOKEN)
-logger.log(f"PUSH MODIFIED ORDERS FILE TO SFTP")
-# push new orders
-if os.path.exists(f"files/tmp/{UPDATED_ORDERS_FILE}"):
-    print("Update orders file was found - pushing to FTP")
-    time.sleep(1)
-    sftp_connect(
-        host=host,
-        port=22,
-        username=username,
-        password=password,
-        direction="push",
-        local_file=f"files/tmp/{UPDATED_ORDERS_FILE}",
-        remote_file=f"Orders/POSTFORDERS.csv",
-    )
-else:
-    print("No Orders file found - skipping")
+# single shop run configured through the environment - see multi_tenant_update.py
+# for running several shops and suppliers at once
+run_orders(TenantConfig.from_env())
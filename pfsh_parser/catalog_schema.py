@@ -0,0 +1,145 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Optional
+
+import pandas as pd
+
+# dtype token for money columns - parsed through Decimal and held as whole cents
+# in an Int64 column, so no price ever goes through binary floating point
+PRICE = "price"
+PRICE_STORAGE_DTYPE = "Int64"
+
+# The typed representation of the merged catalog. Columns that aren't listed
+# (titles, descriptions, image links...) are free text and stay as object.
+CATALOG_DTYPES = {
+    # keys - always strings so UPCs keep their leading zeros
+    "Variant SKU [ID]": "string",
+    "Variant Barcode": "string",
+    "Metafield: custom.item_number [single_line_text_field]": "string",
+    # low cardinality labels
+    "Vendor": "category",
+    "Type": "category",
+    "Option1 Name": "category",
+    "Option1 Value": "category",
+    "Variant Country of Origin": "category",
+    "Metafield: custom.gender_category [single_line_text_field]": "category",
+    # quantities and dimensions
+    "Variant Inventory Qty": "Int32",
+    "Variant Inventory QTY": "Int32",
+    "Metafield: custom.length [number_integer]": "Int32",
+    "Metafield: custom.width [number_integer]": "Int32",
+    "Metafield: custom.height [number_integer]": "Int32",
+    "Metafield: custom.case_pack_size [number_integer]": "Int32",
+    "Metafield: custom.case_weight_pounds [number_integer]": "Int32",
+    "Metafield: custom.length_inches [number_integer]": "Int32",
+    "Metafield: custom.height_inches [number_integer]": "Int32",
+    "Metafield: custom.width_inches [number_integer]": "Int32",
+    "Metafield: custom.year [number_integer]": "Int16",
+    "Variant Weight": "float64",
+    # money
+    "Variant Price": PRICE,
+    "Variant Cost": PRICE,
+}
+
+_CENTS = Decimal("0.01")
+
+
+def _to_text(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    # excel and read_csv hand long codes back as numbers - don't let them turn into "123.0"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _to_price(value):
+    """Parse a price into whole cents."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    try:
+        amount = Decimal(str(value).replace("$", "").replace(",", "").strip())
+        return int(amount.quantize(_CENTS, rounding=ROUND_HALF_UP).scaleb(2))
+    except InvalidOperation:
+        return None
+
+
+def price_to_decimal(cents) -> Optional[Decimal]:
+    """Turn a value of a price column (whole cents) back into an exact Decimal amount."""
+    if cents is None or pd.isna(cents):
+        return None
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def with_decimal_prices(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return df with its price columns as Decimal amounts, for writing files.
+
+    Excel and CSV output would otherwise show the stored cents.
+    """
+    price_columns = [
+        column
+        for column, dtype in CATALOG_DTYPES.items()
+        if dtype == PRICE and column in df.columns
+    ]
+    if not price_columns:
+        return df
+    df = df.copy()
+    for column in price_columns:
+        df[column] = (
+            df[column].map(price_to_decimal, na_action="ignore").astype("object")
+        )
+    return df
+
+
+def coerce_series(values, dtype) -> pd.Series:
+    """
+    Convert raw values (a list or Series) to one of the catalog dtypes.
+
+    Values that can't be converted become missing instead of raising, the same
+    way a blank cell would.
+    """
+    series = pd.Series(values, dtype="object")
+    if dtype is None or dtype == "object":
+        return series
+    if dtype == "string":
+        return series.map(_to_text).astype("string")
+    if dtype == PRICE:
+        return series.map(_to_price).astype(PRICE_STORAGE_DTYPE)
+    if dtype == "category":
+        return series.map(_to_text).astype("category")
+    if pd.api.types.is_integer_dtype(pd.api.types.pandas_dtype(dtype)):
+        return pd.to_numeric(series, errors="coerce").round().astype(dtype)
+    if pd.api.types.is_numeric_dtype(pd.api.types.pandas_dtype(dtype)):
+        return pd.to_numeric(series, errors="coerce").astype(dtype)
+    return series.astype(dtype)
+
+
+def apply_catalog_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """Return df with every column listed in CATALOG_DTYPES converted to its catalog dtype."""
+    df = df.copy()
+    for column, dtype in CATALOG_DTYPES.items():
+        if column not in df.columns:
+            continue
+        if dtype == PRICE and df[column].dtype == PRICE_STORAGE_DTYPE:
+            continue  # already cents - parsing again would read them as dollars
+        df[column] = coerce_series(df[column], dtype).set_axis(df.index)
+    return df
+
+
+def catalog_memory_summary(before: pd.DataFrame, after: pd.DataFrame) -> str:
+    """
+    One line on how much memory the catalog takes before and after applying the schema.
+
+    benchmarks/catalog_memory.py breaks this down per column.
+    """
+    total_before = before.memory_usage(deep=True, index=False).sum()
+    total_after = after.memory_usage(deep=True, index=False).sum()
+    saved = 1 - total_after / total_before if total_before else 0
+    return (
+        f"{mib(total_before)} -> {mib(total_after)} "
+        f"({saved:.0%} smaller, {len(after)} rows)"
+    )
+
+
+def mib(size) -> str:
+    return f"{size / 2**20:.2f}MiB"
@@ -20,3 +20,27 @@ try:
     EMAIL_PORT = os.environ["EMAIL_PORT"]
 except KeyError:
     raise Exception("VALUES NOT FOUND")
+
+# Optional settings - not every job needs these so they fall back to defaults
+SHOPIFY_WEBHOOK_SECRET = os.environ.get("SHOPIFY_WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8080"))
+# "single" pushes one xlsx, "sharded" pushes zipped CSV shards with a manifest,
+# "api" skips Matrixify and sets quantities and costs through the Shopify API
+INVENTORY_EXPORT_MODE = os.environ.get("INVENTORY_EXPORT_MODE") or "single"
+INVENTORY_SHARD_ROWS = int(os.environ.get("INVENTORY_SHARD_ROWS") or 5000)
+INVENTORY_SHARD_BY = os.environ.get("INVENTORY_SHARD_BY") or None
+# used by INVENTORY_EXPORT_MODE=api - defaults to the first active location
+SHOPIFY_LOCATION_ID = os.environ.get("SHOPIFY_LOCATION_ID") or None
+INVENTORY_SYNC_DRY_RUN = os.environ.get("INVENTORY_SYNC_DRY_RUN", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# "1" profiles CPU and memory of each pipeline stage, "cpu" skips the memory tracing
+PFSH_PROFILE = os.environ.get("PFSH_PROFILE", "").lower()
+if PFSH_PROFILE in ("0", "false", "no"):
+    PFSH_PROFILE = ""
+PFSH_PROFILE_DIR = os.environ.get("PFSH_PROFILE_DIR") or "files/profiles"
+# risky order alerts raised within this many seconds are sent as one email
+RISK_DIGEST_WINDOW = float(os.environ.get("RISK_DIGEST_WINDOW") or 300)
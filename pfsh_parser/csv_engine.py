@@ -1,85 +1,158 @@
+import os
+from dataclasses import dataclass, field
+
 import pycountry
 import pandas as pd
 from pfsh_parser.log_engine import LogEngine
-from pfsh_parser.creds import LOG_FILE, EMAIL_SENDER, EMAIL_PASSWORD, RECIPIENT_LIST, EMAIL_SERVER, EMAIL_PORT
+from pfsh_parser.creds import (
+    LOG_FILE,
+    EMAIL_SENDER,
+    EMAIL_PASSWORD,
+    RECIPIENT_LIST,
+    EMAIL_SERVER,
+    EMAIL_PORT,
+    MASTER_INVENTORY_FILE,
+    RISK_DIGEST_WINDOW,
+)
 from pfsh_parser.shopify_engine import ShopifyClient
-from pfsh_parser.smtp_engine import EmailSender
+from pfsh_parser.smtp_engine import EmailSender, MailQueue
+from pfsh_parser.xlsx_engine import MATRIXIFY_HEADER_MAP, read_projected_sheet
+from pfsh_parser.order_writer import OrderCsvWriter
+from pfsh_parser.outbox_engine import OUTBOX_DB, MutationOutbox
+from pfsh_parser.profile_engine import profile_stage
+from pfsh_parser.sku_index import (
+    SKU_INDEX_FILE,
+    SkuIndex,
+    file_fingerprint,
+    load_sku_index,
+)
+from pfsh_parser.catalog_schema import (
+    CATALOG_DTYPES,
+    apply_catalog_schema,
+    catalog_memory_summary,
+    with_decimal_prices,
+)
 import pycountry
 
+ORDERS_OUTPUT_FILE = "files/tmp/adjusted_orders_file.csv"
+# orders whose fulfillments are sent together before their rows are written
+ORDER_FLUSH_SIZE = 25
+# absolute so email templates are found whatever the working directory is
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+_mail_queue = None
+
+
+@dataclass
+class OrderRunReport:
+    # rows in the orders file, including rows committed by an interrupted earlier run
+    rows: int = 0
+    # orders whose rows were written to the file
+    written: list = field(default_factory=list)
+    # orders held back because of their fraud score
+    risky: list = field(default_factory=list)
+    # orders not ready yet, e.g. not assessed for fraud - tried again on a later run
+    deferred: list = field(default_factory=list)
+    # orders that went wrong - left out of the file so a later run picks them up
+    failed: list = field(default_factory=list)
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.written)} orders written, {len(self.risky)} risky, "
+            f"{len(self.deferred)} deferred, {len(self.failed)} failed"
+        )
+
+
+def new_mail_queue(
+    smtp_server=EMAIL_SERVER,
+    smtp_port=EMAIL_PORT,
+    username=EMAIL_SENDER,
+    password=EMAIL_PASSWORD,
+    digest_window=RISK_DIGEST_WINDOW,
+) -> MailQueue:
+    """A mail queue for alert emails with the given SMTP settings, the environment's by default."""
+    return MailQueue(
+        EmailSender(
+            smtp_server=smtp_server,
+            smtp_port=smtp_port,
+            username=username,
+            password=password,
+            template_dir=TEMPLATE_DIR,
+        ),
+        digest_window=digest_window,
+    )
+
+
+def get_mail_queue() -> MailQueue:
+    """The process wide queue alert emails are sent through, started on first use."""
+    global _mail_queue
+    if _mail_queue is None:
+        _mail_queue = new_mail_queue()
+    return _mail_queue
+
+
+def close_mail_queue():
+    """Send any pending alerts. Worker processes exit without running atexit hooks, so they call this."""
+    global _mail_queue
+    if _mail_queue is not None:
+        _mail_queue.close()
+        _mail_queue = None
+
+
 def build_matrixify_master_file(master_file):
     try:
-        jcbeaninv_df = pd.read_excel(master_file, engine="openpyxl", sheet_name=1)
+        # only the mapped columns are read, already renamed and typed
+        jcbeaninv_df = read_projected_sheet(
+            master_file,
+            MATRIXIFY_HEADER_MAP,
+            sheet_index=1,
+            dtypes=CATALOG_DTYPES,
+        )
         print("succesfully read file!")
         print(jcbeaninv_df.columns.tolist())
 
-        header_map = {
-            "ITEM #": "Metafield: custom.item_number [single_line_text_field]",
-            "MFG UPC": "Variant Barcode",
-            "COO": "Variant Country of Origin",
-            "Weight": "Variant Weight",
-            "Length": "Metafield: custom.length [number_integer]",
-            "Width": "Metafield: custom.width [number_integer]",
-            "Height": "Metafield: custom.height [number_integer]",
-            "SIZE": "Option1 Value",
-            "Case Pack\nSize": "Metafield: custom.case_pack_size [number_integer]",
-            "Case \nWeight\n(LB)": "Metafield: custom.case_weight_pounds [number_integer]",
-            "Case \nLength\n(in)": "Metafield: custom.length_inches [number_integer]",
-            "Case\nHeight\n(in)": "Metafield: custom.height_inches [number_integer]",
-            "Case\nWidth\n(in)": "Metafield: custom.width_inches [number_integer]",
-            "DESCRIPTION": "Title", #name of product
-            "EXTENDED DESCRIPTION": "Body HTML", #actual of description of product
-            "KEY FEATURE1": "Metafield: custom.key_feature_1 [single_line_text_field]",
-            "KEY FEATURE2": "Metafield: custom.key_feature_2 [single_line_text_field]",
-            "KEY FEATURE3": "Metafield: custom.key_feature_3 [single_line_text_field]",
-            "SHERALVEN UPC": "Variant SKU [ID]",
-            "Gender Description": "Type",
-            "MSRP": "Variant Price",
-            "DIRECTIONS FOR USE": "Metafield: how_to_use [single_line_text_field]",
-            "Ingredients": "Metafield: custom.ingredients [single_line_text_field]",
-            "Main Picture Link Bottle & Box on White Background": "Image Src",
-            "TOP NOTES": "Metafield: custom.top_notes [single_line_text_field]",
-            "MIDDLE NOTES": "Metafield: custom.middle_notes [single_line_text_field]",
-            "BASE NOTES": "Metafield: custom.base_notes [single_line_text_field]",
-            "SCENT TYPE": "Metafield: custom.scent_type [single_line_text_field]",
-            "YEAR RELEASED": "Metafield: custom.year [number_integer]",
-            "Brand Name": "Vendor"
-        }
-
-        # Rename columns based on the header map
-        jcbeaninv_df = jcbeaninv_df.rename(columns=header_map)
-
         # Add the 'Size' column and pre-populate with 'size'
         print("adding in option1 name column with size value")
-        jcbeaninv_df['Option1 Name'] = 'Size'
+        jcbeaninv_df["Option1 Name"] = "Size"
 
         # Add the 'Variant Inventory QTY' column and populate all values with 0
         print("updating inventory qty to 0")
-        jcbeaninv_df['Variant Inventory QTY'] = 0
+        jcbeaninv_df["Variant Inventory QTY"] = 0
 
-        #change the name of the country to two letter code
+        # change the name of the country to two letter code
         print("trying to update country to two letter code")
-        jcbeaninv_df['Variant Country of Origin'] = jcbeaninv_df['Variant Country of Origin'].apply(convert_country_name_to_iso)
+        # categorical column so this only looks up each distinct country once
+        jcbeaninv_df["Variant Country of Origin"] = jcbeaninv_df[
+            "Variant Country of Origin"
+        ].map(convert_country_name_to_iso)
+        jcbeaninv_df = apply_catalog_schema(jcbeaninv_df)
 
-        #remove empty rows wthout any item numbers as we 100% need these to send to drop shipper
-        print('Removing rows without Item #')
-        jcbeaninv_df = jcbeaninv_df.dropna(subset=['Metafield: custom.item_number [single_line_text_field]'])
-        #remove items without a price
-        print('Removing rows without a price')
-        jcbeaninv_df = jcbeaninv_df.dropna(subset=['Variant Price'])
-        print('Removing Unamed empty columsn')
-        jcbeaninv_df = jcbeaninv_df.loc[:, ~jcbeaninv_df.columns.str.contains('^Unnamed')]
+        # remove empty rows wthout any item numbers as we 100% need these to send to drop shipper
+        print("Removing rows without Item #")
+        jcbeaninv_df = jcbeaninv_df.dropna(
+            subset=["Metafield: custom.item_number [single_line_text_field]"]
+        )
+        # remove items without a price
+        print("Removing rows without a price")
+        jcbeaninv_df = jcbeaninv_df.dropna(subset=["Variant Price"])
 
         # Save the updated dataframe to a new CSV file
         output_file = "files/tmp/updated_inventory.xlsx"
-        jcbeaninv_df.to_excel(output_file, index=False)
+        with_decimal_prices(jcbeaninv_df).to_excel(output_file, index=False)
 
         print(f"Updated CSV file saved as {output_file}")
     except Exception as e:
         print(e)
 
-def daily_inventory_parser(csv_file, master_file):
+
+def daily_inventory_parser(
+    csv_file,
+    master_file,
+    output_file="files/tmp/updated_master_inventory.xlsx",
+    log_file=LOG_FILE,
+    sku_index_file=SKU_INDEX_FILE,
+):
     # Mapping of CSV headers to master file headers
-    logger = LogEngine(file_path=LOG_FILE)
+    logger = LogEngine(file_path=log_file)
     header_mapper = {
         "AV": "Variant Inventory Qty",
         "Item#": "Metafield: custom.item_number [single_line_text_field]",
@@ -93,196 +166,380 @@ def daily_inventory_parser(csv_file, master_file):
         "UPC": "Variant SKU [ID]",
         "MFGUPC": " Variant Barcode",
     }
-    logger.log("INVENTORY: LOADING BASE INVENTORY FILE")
-    # Load the CSV file and preprocess
-    jcbeaninv_df = pd.read_csv(csv_file, encoding="ISO-8859-1")
-    # Drop the 'Reference' column if it exists
-    logger.log("INVENTORY: DROPPING UNEEDED COLUMNS FROM BASE INVENTORY FILE")
-    jcbeaninv_df.drop(columns=["Reference"], errors="ignore", inplace=True)
-    # Map the CSV file headers to the master file headers
-    logger.log("INVENTORY: MAPPING HEADER COLUMNS TO MATCH")
-    jcbeaninv_df.columns = [header_mapper.get(col, col) for col in jcbeaninv_df.columns]
-
-    # Load the master inventory file
-    logger.log("INVENTORY: LOADING MASTER INVENTORY FILE")
-    final_cleaned_df = pd.read_excel(master_file, engine="openpyxl")
+    with profile_stage("inventory_load"):
+        logger.log("INVENTORY: LOADING BASE INVENTORY FILE")
+        # Load the CSV file and preprocess
+        # read the codes as text so UPCs keep their leading zeros
+        jcbeaninv_df = pd.read_csv(
+            csv_file,
+            encoding="ISO-8859-1",
+            dtype={"UPC": str, "MFGUPC": str, "Item#": str},
+        )
+        # Drop the 'Reference' column if it exists
+        logger.log("INVENTORY: DROPPING UNEEDED COLUMNS FROM BASE INVENTORY FILE")
+        jcbeaninv_df.drop(columns=["Reference"], errors="ignore", inplace=True)
+        # Map the CSV file headers to the master file headers
+        logger.log("INVENTORY: MAPPING HEADER COLUMNS TO MATCH")
+        jcbeaninv_df.columns = [
+            header_mapper.get(col, col) for col in jcbeaninv_df.columns
+        ]
+        jcbeaninv_df = apply_catalog_schema(jcbeaninv_df)
+
+        # Load the master inventory file
+        logger.log("INVENTORY: LOADING MASTER INVENTORY FILE")
+        raw_master_df = pd.read_excel(
+            master_file,
+            engine="openpyxl",
+            dtype={
+                column: str
+                for column, dtype in CATALOG_DTYPES.items()
+                if dtype == "string"
+            },
+        )
+        final_cleaned_df = apply_catalog_schema(raw_master_df)
+        logger.log(
+            f"INVENTORY: MASTER CATALOG MEMORY {catalog_memory_summary(raw_master_df, final_cleaned_df)}"
+        )
+        del raw_master_df
 
     # Merge the CSV data with the master file based on the item number,
     # updating only if the CSV provides new information
-    logger.log("INVENTORY: MERGING COLUMNS")
-    for column in jcbeaninv_df.columns:
-        if column in final_cleaned_df.columns and column != "Variant SKU [ID]":
-            # Create a temporary merged DataFrame to extract updated values
-            temp_merged_df = final_cleaned_df.merge(
-                jcbeaninv_df[["Variant SKU [ID]", column]],
-                on="Variant SKU [ID]",
-                how="left",
-                suffixes=("", "_updated"),
-            )
-            # Update the original master DataFrame column with the new values from CSV where applicable
-            final_cleaned_df[column] = temp_merged_df[
-                column + "_updated"
-            ].combine_first(final_cleaned_df[column])
+    with profile_stage("inventory_merge"):
+        logger.log("INVENTORY: MERGING COLUMNS")
+        for column in jcbeaninv_df.columns:
+            if column in final_cleaned_df.columns and column != "Variant SKU [ID]":
+                # Create a temporary merged DataFrame to extract updated values
+                temp_merged_df = final_cleaned_df.merge(
+                    jcbeaninv_df[["Variant SKU [ID]", column]],
+                    on="Variant SKU [ID]",
+                    how="left",
+                    suffixes=("", "_updated"),
+                )
+                # Update the original master DataFrame column with the new values from CSV where applicable
+                final_cleaned_df[column] = temp_merged_df[
+                    column + "_updated"
+                ].combine_first(final_cleaned_df[column])
+        # combining categoricals with different categories falls back to object
+        final_cleaned_df = apply_catalog_schema(final_cleaned_df)
+    # refresh the SKU index the order job uses with the merged costs
+    logger.log("INVENTORY: REBUILDING SKU INDEX")
+    SkuIndex.from_catalog(final_cleaned_df, file_fingerprint(master_file)).save(
+        sku_index_file
+    )
 
     # Convert country names in the "Variant Country of Origin" column to ISO codes
     if "Variant Country of Origin" in final_cleaned_df.columns:
-        logger.log("INVENTORY: CONVERTING COUNTRY NAMES TO ISO CODES")
-        final_cleaned_df["Variant Country of Origin"] = final_cleaned_df[
-            "Variant Country of Origin"
-        ].apply(convert_country_name_to_iso)
+        with profile_stage("inventory_country_iso"):
+            logger.log("INVENTORY: CONVERTING COUNTRY NAMES TO ISO CODES")
+            final_cleaned_df["Variant Country of Origin"] = (
+                final_cleaned_df["Variant Country of Origin"]
+                .map(convert_country_name_to_iso)
+                .astype("category")
+            )
+
+    # Save the updated master file to a new file - skipped when the caller exports it another way
+    if output_file:
+        with profile_stage("inventory_write"):
+            logger.log("INVENTORY: GENERATING NEW FILE")
+            with_decimal_prices(final_cleaned_df).to_excel(output_file, index=False)
+    return final_cleaned_df
+
 
-    # Save the updated master file to a new file
-    logger.log("INVENTORY: GENERATING NEW FILE")
-    updated_final_cleaned_path = "files/tmp/updated_master_inventory.xlsx"
-    final_cleaned_df.to_excel(updated_final_cleaned_path, index=False)
+def order_parser(
+    shop_name,
+    status,
+    access_token,
+    output_file=ORDERS_OUTPUT_FILE,
+    log_file=LOG_FILE,
+    **process_options,
+):
+    """
+    Fetch the shop's orders with the given status and process them.
 
+    process_options are passed on to process_orders.
 
-def order_parser(shop_name, status, access_token,):
-    logger = LogEngine(file_path=LOG_FILE)
+    Returns:
+        OrderRunReport: What happened to each order, empty when none were found.
+    """
+    logger = LogEngine(file_path=log_file)
     logger.log("Fetching Orders from API endpoint")
     sh_client = ShopifyClient(shop_name, access_token)
     # gets new orders
-    orders = sh_client.get_orders(status)
+    with profile_stage("orders_fetch"):
+        orders = sh_client.get_orders(status)
     if orders is None:
         logger.log(f"No orders found with status {status}. Halting further action.")
-        return  # Exit the function if no orders are found
-    order_list = []
-    line_items_list = []
-    risky_order_dict = {
-        "orders": []
-    }
-    column_names = [
-        "PONUMBER",
-        "ITEM",
-        "QTYORDERED",
-        "ORDUNIT",
-        "SHPNAME(30)",
-        "SHPADDR1(30) - DO NOT LEAVE BLANK",
-        "SHPADDR2(30)",
-        "SHPCITY(16)",
-        "SHPSTATE(2)",
-        "SHPCOUNTRY(3)",
-        "SHPZIP(10)",
-        "SHIPVIA",
-        "PRIUNTPRC",
-    ]
+        return OrderRunReport()  # Exit the function if no orders are found
+    return process_orders(
+        sh_client, orders, output_file, log_file=log_file, **process_options
+    )
+
+
+def process_orders(
+    sh_client,
+    orders,
+    output_file=ORDERS_OUTPUT_FILE,
+    log_file=LOG_FILE,
+    master_file=None,
+    sku_index_file=SKU_INDEX_FILE,
+    outbox_db=OUTBOX_DB,
+    mail_queue=None,
+    email_sender=EMAIL_SENDER,
+    recipient_list=RECIPIENT_LIST,
+):
+    """
+    Fulfill a batch of already fetched orders and write the Sheralven PO file.
+
+    Used by order_parser for the scheduled run and by the order daemon for
+    orders received through webhooks. Settings not passed in come from the
+    environment: master_file defaults to files/<MASTER_INVENTORY_FILE> and
+    risky order alerts go through get_mail_queue().
+
+    An order that raises is logged and left out of the file, the others carry on.
+
+    Returns:
+        OrderRunReport: What happened to each order and the number of rows in
+        output_file, including rows committed by an earlier run that was interrupted.
+    """
+    logger = LogEngine(file_path=log_file)
+    risky_order_dict = {"orders": []}
+    report = OrderRunReport()
+
+    sku_index = _load_order_sku_index(
+        logger, master_file or f"files/{MASTER_INVENTORY_FILE}", sku_index_file
+    )
+    # fulfillments are sent through the outbox in batches, and an order's rows are
+    # only committed once its fulfillment went through
+    outbox = MutationOutbox(sh_client, db_path=outbox_db, log_file=log_file)
+    # rows are streamed to the file order by order, resuming from its journal if a
+    # previous run was interrupted
+    writer = OrderCsvWriter(output_file)
+    if writer.committed:
+        logger.log(
+            f"Resuming orders file with {len(writer.committed)} orders already written"
+        )
+    # order ID -> rows waiting for the fulfillment to be sent
+    pending_rows = {}
 
-    # Initialize the DataFrame with column names to ensure headers are always present
-    logger.log("Setting headers for CSV")
-    df = pd.DataFrame(columns=column_names)
-    for data in orders:
-        # Check the Order Risk
-        order_risk = sh_client.get_order_risk_number(data['id'])
-        if order_risk >= .5:
-            #probably shouldn't link the store id like this
-            risky_order_dict['orders'].append(
-                {
-                    "id": data['id'],
-                    "link": f"https://admin.shopify.com/store/2b6816-2/orders/{data['id']}"
-                }
+    def flush_fulfillments():
+        outbox.flush()
+        for order_id, order_rows in pending_rows.items():
+            if int(order_id) in outbox.report.failed_orders:
+                # not fulfilled - left out of the file so the next run picks it up again
+                logger.log(
+                    f"Fulfillment failed for order {order_id} - not sent to Sheralven"
+                )
+                report.failed.append(order_id)
+                continue
+            # commit the order's rows now so a crash later in the run can't lose them
+            writer.write_order(order_id, order_rows)
+            report.written.append(order_id)
+        pending_rows.clear()
+
+    with profile_stage("orders_loop"):
+        try:
+            for data in orders:
+                if writer.is_committed(data["id"]):
+                    # already written by a run that was interrupted - don't redo the API work
+                    print(f"order ID: {data['id']} already in {output_file} - skipping")
+                    report.written.append(data["id"])
+                    continue
+                try:
+                    # Check the Order Risk
+                    order_risk = sh_client.get_order_risk_number(data["id"])
+                    if order_risk is None:
+                        # webhooks can arrive before Shopify scored the order
+                        logger.log(
+                            f"No fraud score yet for order {data['id']} - leaving it for later"
+                        )
+                        report.deferred.append(data["id"])
+                        continue
+                    if order_risk >= 0.5:
+                        risky_order_dict["orders"].append(
+                            {
+                                "id": data["id"],
+                                "link": order_admin_link(
+                                    sh_client.shop_name, data["id"]
+                                ),
+                            }
+                        )
+                        report.risky.append(data["id"])
+                        # skip this order
+                        continue
+                    # Create the fulfillment
+                    fulfillment_orders = sh_client.get_fulfillment_orders(data["id"])
+                    print(
+                        f"order ID: {data['id']} fulfillment ID: {[fulfillment_order.id for fulfillment_order in fulfillment_orders]}"
+                    )
+                    if not any(
+                        fulfillment_order.is_open
+                        or fulfillment_order.status == "closed"
+                        for fulfillment_order in fulfillment_orders
+                    ):
+                        # on hold or scheduled - send it once it can actually be fulfilled
+                        logger.log(
+                            f"Order {data['id']} has nothing to fulfill yet - leaving it for later"
+                        )
+                        report.deferred.append(data["id"])
+                        continue
+                    order_rows = _order_rows(sh_client, sku_index, data)
+                except Exception as e:
+                    # nothing was queued for the order yet, so it can simply be tried again
+                    logger.log(
+                        f"Processing order {data['id']} failed - not sent to Sheralven: {e}"
+                    )
+                    report.failed.append(data["id"])
+                    continue
+                # queues the fulfillments - the statuses came with the fulfillment orders
+                outbox.create_fulfillment(data["id"], fulfillment_orders)
+                pending_rows[data["id"]] = order_rows
+                if len(pending_rows) >= ORDER_FLUSH_SIZE:
+                    flush_fulfillments()
+            flush_fulfillments()
+        finally:
+            writer.close()
+            outbox.close()
+    logger.log(f"ORDERS: {report.summary()}")
+    logger.log(f"ORDERS: {outbox.report.summary()}")
+    # SEND email for risky orders - queued, and combined with other alerts raised within the digest window
+    if risky_order_dict["orders"]:
+        emails_list = [
+            email.strip() for email in recipient_list.split(",") if email.strip()
+        ]
+        (mail_queue or get_mail_queue()).add_to_digest(
+            subject="FRADULENT ORDERS FOUND",
+            sender=email_sender,
+            recipients=emails_list,
+            template_name="risky_orders_email.html",
+            items=risky_order_dict["orders"],
+            items_key="orders",
+        )
+    if writer.rows_written:
+        logger.log(f"Wrote {writer.rows_written} order rows to {output_file}")
+    report.rows = writer.total_rows
+    return report
+
+
+def order_admin_link(shop_name, order_id) -> str:
+    """Link to an order in the Shopify admin of the shop, e.g. for jcbean.myshopify.com."""
+    handle = shop_name.strip().split("://")[-1].strip("/")
+    handle = handle.removesuffix(".myshopify.com")
+    return f"https://admin.shopify.com/store/{handle}/orders/{order_id}"
+
+
+def _order_rows(sh_client, sku_index, data) -> list:
+    """The Sheralven PO rows of one order."""
+    order_rows = []
+    for line_item in data["line_items"]:
+        # the SKU index answers most lookups - only go to the API for what it's missing
+        sku_entry = sku_index.lookup(sku=line_item["sku"])
+        if sku_entry is None and sku_index.by_barcode and line_item.get("variant_id"):
+            # order line items carry no barcode - when the SKU was changed in Shopify one
+            # small variant call can still save the cost and metafield lookups below
+            sku_entry = sku_index.lookup(
+                barcode=sh_client.get_variant_barcode(line_item["variant_id"])
             )
-            #skip this order
-            continue
-        # Create the fulfillment
-        fulfillment_order_id_list = sh_client.get_fulfillment_order_id(data["id"])
-        print(f"order ID: {data['id']} fulfillment ID: {fulfillment_order_id_list}")
-        # creates the fulfillment
-        sh_client.create_fulfillment(fulfillment_order_id_list)
-
-        for line_item in data["line_items"]:
-            # get the cost of the item
+
+        # get the cost of the item
+        if sku_entry is not None and sku_entry.cost is not None:
+            variant_cost = sku_entry.cost
+        else:
             variant_cost = sh_client.get_variant_cost(
                 line_item["product_id"], line_item["sku"]
             )
 
-            # get the sheravlen product ID
+        # get the sheravlen product ID
+        if sku_entry is not None and sku_entry.item_number:
+            sheralven_item_id = sku_entry.item_number
+        else:
+            sheralven_item_id = "N/A"
             product_metafields = sh_client.get_product_metafields(
                 line_item["product_id"]
             )
-
             if product_metafields:
                 for item in product_metafields:
                     if item.get("key") == "item_number":
                         sheralven_item_id = item.get("value")
-            else:
-                sheralven_item_id = "N/A"
-            order_list.append(
-                {
-                    "PONUMBER": data["id"],
-                    "ITEM": sheralven_item_id,
-                    "QTYORDERED": line_item["quantity"],
-                    "ORDUNIT": "EA",
-                    "SHPNAME(30)": data["shipping_address"]["name"],
-                    "SHPADDR1(30) - DO NOT LEAVE BLANK": data["shipping_address"][
-                        "address1"
-                    ],
-                    "SHPADDR2(30)": data["shipping_address"]["address2"],
-                    "SHPCITY(16)": data["shipping_address"]["city"],
-                    "SHPSTATE(2)": data["shipping_address"]["province_code"],
-                    "SHPCOUNTRY(3)": data["shipping_address"]["country_code"],
-                    "SHPZIP(10)": data["shipping_address"]["zip"],
-                    "SHIPVIA": data["shipping_lines"][0]["code"],
-                    "PRIUNTPRC": variant_cost,
-                }
-            )
-    # SEND email for risky orders
-    if risky_order_dict['orders']:
-        email_sender = EmailSender(
-            smtp_server=EMAIL_SERVER,
-            smtp_port=EMAIL_PORT,
-            username=EMAIL_SENDER,
-            password=EMAIL_PASSWORD,
-            template_dir="pfsh_parser/templates"
+        order_rows.append(
+            {
+                "PONUMBER": data["id"],
+                "ITEM": sheralven_item_id,
+                "QTYORDERED": line_item["quantity"],
+                "ORDUNIT": "EA",
+                "SHPNAME(30)": data["shipping_address"]["name"],
+                "SHPADDR1(30) - DO NOT LEAVE BLANK": data["shipping_address"][
+                    "address1"
+                ],
+                "SHPADDR2(30)": data["shipping_address"]["address2"],
+                "SHPCITY(16)": data["shipping_address"]["city"],
+                "SHPSTATE(2)": data["shipping_address"]["province_code"],
+                "SHPCOUNTRY(3)": data["shipping_address"]["country_code"],
+                "SHPZIP(10)": data["shipping_address"]["zip"],
+                "SHIPVIA": data["shipping_lines"][0]["code"],
+                "PRIUNTPRC": variant_cost,
+            }
         )
-        emails_list = [email.strip() for email in RECIPIENT_LIST.split(",") if email.strip()]
-        email_sender.send_template_email(
-            subject="FRADULENT ORDERS FOUND",
-            sender=EMAIL_SENDER,
-            recipients=emails_list,
-            template_name="risky_orders_email.html",
-            context=risky_order_dict
-        )
-    if order_list:  # Only update df if there are orders
-        logger.log("Orders found - flattening data")
-        df = pd.json_normalize(order_list)
-        logger.log("Writing CSV File with fetched order data")
-        df.to_csv("files/tmp/adjusted_orders_file.csv", index=False)
+    return order_rows
 
 
-def shipping_parser(csv_file, shop_name, access_token):
-    logger = LogEngine(file_path=LOG_FILE)
+def _load_order_sku_index(logger, master_file, index_path):
+    try:
+        sku_index = load_sku_index(master_file, index_path)
+        logger.log(f"Loaded SKU index with {len(sku_index)} entries")
+        return sku_index
+    except Exception as e:
+        # without an index every lookup just goes to the API like before
+        logger.log(f"Could not load SKU index - falling back to the API: {e}")
+        return SkuIndex({}, {})
+
+
+def shipping_parser(
+    csv_file, shop_name, access_token, log_file=LOG_FILE, outbox_db=OUTBOX_DB
+):
+    logger = LogEngine(file_path=log_file)
     sh_client = ShopifyClient(shop_name, access_token)
     # orders = sh_client.get_orders("fulfilled")
     orders_df = pd.read_csv(f"{csv_file}")
     orders_list = sh_client.get_unshipped_orders()
     print(orders_list)
-    for index, row in orders_df.iterrows():
-        if (
-            row["Status"] == "SHIP_COMP"
-            and pd.notna(["TRACKINGNUM"])
-            and row["PO NUMBER"] in orders_list
-        ):
-            fullfilment_order_id_list = sh_client.get_fulfillment_order_id(
-                row["PO NUMBER"]
-            )
-            # Grab the fulfillments
-            fulfillments = sh_client.get_fulfillments_by_order_id(row["PO NUMBER"])
-            if fulfillments is not None:
-                print(f"{fulfillments}")
-                for fulfillment in fulfillments:
-                    print(
-                        f"Pushing tracking number {row['TRACKINGNUM']} for Fulfillment {fulfillment}"
-                    )
-                    sh_client.update_fulfillment_shipping(
-                        fulfillment, row["TRACKINGNUM"]
-                    )
-                    # close the order
-                    print(
-                        f"Shipping was updated for order {row['PO NUMBER']} - marking as closed"
-                    )
-                    sh_client.close_order(row["PO NUMBER"])
-        else:
-            print(f"Shipping status set to {row['Status']} for {row['PO NUMBER']}")
+    # tracking updates and closes are collected first, so each order is closed once
+    # and tracking numbers pushed by an earlier run are not sent again
+    outbox = MutationOutbox(sh_client, db_path=outbox_db, log_file=log_file)
+    # the file has a row per item - look each order's fulfillments up once
+    fulfillments_by_order = {}
+    with profile_stage("shipping_loop"):
+        for index, row in orders_df.iterrows():
+            if (
+                row["Status"] == "SHIP_COMP"
+                and pd.notna(row["TRACKINGNUM"])
+                and row["PO NUMBER"] in orders_list
+            ):
+                # Grab the fulfillments
+                if row["PO NUMBER"] not in fulfillments_by_order:
+                    fulfillments_by_order[
+                        row["PO NUMBER"]
+                    ] = sh_client.get_fulfillments_by_order_id(row["PO NUMBER"])
+                fulfillments = fulfillments_by_order[row["PO NUMBER"]]
+                if fulfillments:
+                    print(f"{fulfillments}")
+                    for fulfillment in fulfillments:
+                        print(
+                            f"Queueing tracking number {row['TRACKINGNUM']} for Fulfillment {fulfillment}"
+                        )
+                        outbox.update_tracking(
+                            row["PO NUMBER"], fulfillment, row["TRACKINGNUM"]
+                        )
+                    # close the order once its tracking is updated
+                    outbox.close_order(row["PO NUMBER"])
+            else:
+                print(f"Shipping status set to {row['Status']} for {row['PO NUMBER']}")
+        try:
+            outbox.flush()
+        finally:
+            outbox.close()
+    print(outbox.report.summary())
+    logger.log(f"SHIPPING: {outbox.report.summary()}")
+    return outbox.report
 
 
 def convert_country_name_to_iso(country_name):
@@ -290,8 +547,12 @@ def convert_country_name_to_iso(country_name):
         country = pycountry.countries.lookup(country_name)
         return country.alpha_2
     except LookupError:
-        return "" # Return an empty string if not found
+        return ""  # Return an empty string if not found
+
 
 def clean_column_names(columns):
     """Clean column names by converting to lowercase and removing unwanted characters."""
-    return [col.strip().lower().replace("\n", "").replace("\r", "").replace("\t", "") for col in columns]
+    return [
+        col.strip().lower().replace("\n", "").replace("\r", "").replace("\t", "")
+        for col in columns
+    ]
@@ -0,0 +1,217 @@
+import hashlib
+import io
+import json
+import os
+import zipfile
+from datetime import datetime
+
+import pandas as pd
+
+from pfsh_parser.catalog_schema import with_decimal_prices
+from pfsh_parser.creds import LOG_FILE
+from pfsh_parser.log_engine import LogEngine
+from pfsh_parser.sftp_engine import sftp_push_files
+
+MANIFEST_NAME = "manifest.json"
+# remembers which shards of a snapshot made it to the SFTP server while its push is incomplete
+PUSH_STATE_NAME = "pushed.json"
+# fixed timestamp inside the zips so identical shards always get the same checksum
+_ZIP_DATE_TIME = (2000, 1, 1, 0, 0, 0)
+
+
+def plan_shards(df: pd.DataFrame, max_rows: int, shard_by: str = None) -> list:
+    """
+    Split the catalog into groups of row positions of at most max_rows rows.
+
+    Args:
+        df (pd.DataFrame): The catalog to split.
+        max_rows (int): Maximum number of rows in a shard.
+        shard_by (Optional[str]): Column whose values are kept together, e.g. "Vendor".
+            Groups are packed into shards in order and only a group bigger than
+            max_rows is split. Without it the catalog is cut every max_rows rows.
+
+    Returns:
+        list: A list of position lists, one per shard.
+    """
+    if shard_by is None or shard_by not in df.columns:
+        return [
+            list(range(start, min(start + max_rows, len(df))))
+            for start in range(0, len(df), max_rows)
+        ]
+
+    shards = []
+    current = []
+    keys = df[shard_by].astype("object").fillna("")
+    for _, positions in keys.groupby(keys, sort=True).indices.items():
+        positions = list(positions)
+        if len(current) + len(positions) > max_rows and current:
+            shards.append(current)
+            current = []
+        # a single group bigger than a shard gets cut into full shards
+        while len(positions) > max_rows:
+            shards.append(positions[:max_rows])
+            positions = positions[max_rows:]
+        current.extend(positions)
+    if current:
+        shards.append(current)
+    return shards
+
+
+def write_sharded_export(
+    df: pd.DataFrame,
+    output_dir: str,
+    max_rows: int = 5000,
+    shard_by: str = None,
+    prefix: str = "inventory",
+    log_file: str = LOG_FILE,
+) -> str:
+    """
+    Write the catalog as zipped CSV shards plus a manifest with their checksums.
+
+    Returns:
+        str: Path to the manifest.
+    """
+    logger = LogEngine(file_path=log_file)
+    os.makedirs(output_dir, exist_ok=True)
+    # clear out shards from a previous run so they can't be pushed by mistake
+    for name in os.listdir(output_dir):
+        if name.startswith(f"{prefix}_") and name.endswith(".zip"):
+            os.remove(os.path.join(output_dir, name))
+
+    shards = []
+    for number, positions in enumerate(plan_shards(df, max_rows, shard_by), start=1):
+        name = f"{prefix}_{number:03d}"
+        # prices are held as cents - write them as amounts
+        shard_df = with_decimal_prices(df.iloc[positions])
+        csv_bytes = shard_df.to_csv(index=False).encode("utf-8")
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            info = zipfile.ZipInfo(f"{name}.csv", date_time=_ZIP_DATE_TIME)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(info, csv_bytes, compresslevel=9)
+        data = buffer.getvalue()
+
+        with open(os.path.join(output_dir, f"{name}.zip"), "wb") as file:
+            file.write(data)
+        shards.append(
+            {
+                "file": f"{name}.zip",
+                "rows": len(shard_df),
+                "csv_bytes": len(csv_bytes),
+                "bytes": len(data),
+                "sha256": hashlib.sha256(data).hexdigest(),
+            }
+        )
+
+    manifest = {
+        "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "rows": len(df),
+        "max_rows": max_rows,
+        "shard_by": shard_by,
+        "shards": shards,
+    }
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, indent=2)
+    logger.log(f"EXPORT: WROTE {len(shards)} SHARDS FOR {len(df)} ROWS TO {output_dir}")
+    return manifest_path
+
+
+def push_sharded_export(
+    manifest_path,
+    remote_dir,
+    host,
+    port,
+    username,
+    password,
+    retries=2,
+    log_file=LOG_FILE,
+) -> dict:
+    """
+    Push the shards listed in a manifest, then the manifest itself.
+
+    Progress is recorded after every shard, so after a partial failure a rerun
+    of the same snapshot only sends the shards that didn't make it. The
+    progress is tied to the snapshot's shard checksums and cleared once the
+    manifest is delivered, so the next snapshot is always pushed in full.
+
+    Returns:
+        dict: Lists of the pushed, skipped and failed files. The manifest is
+        listed as failed when its upload failed.
+    """
+    logger = LogEngine(file_path=log_file)
+    output_dir = os.path.dirname(manifest_path)
+    state_path = os.path.join(output_dir, PUSH_STATE_NAME)
+    with open(manifest_path) as file:
+        manifest = json.load(file)
+
+    checksums = {shard["file"]: shard["sha256"] for shard in manifest["shards"]}
+    # the manifest itself carries a timestamp, so the snapshot is identified by its shards
+    snapshot = hashlib.sha256(
+        json.dumps(sorted(checksums.items())).encode("utf-8")
+    ).hexdigest()
+    pushed_state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as file:
+            state = json.load(file)
+        # progress of a different snapshot says nothing about this one
+        if state.get("snapshot") == snapshot:
+            pushed_state = state.get("shards", {})
+
+    def record(local_file, remote_file):
+        name = os.path.basename(local_file)
+        pushed_state[name] = checksums[name]
+        with open(state_path, "w") as file:
+            json.dump({"snapshot": snapshot, "shards": pushed_state}, file, indent=2)
+
+    pending = [
+        name for name, sha256 in checksums.items() if pushed_state.get(name) != sha256
+    ]
+    skipped = [name for name in checksums if name not in pending]
+    pushed = []
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        failures = sftp_push_files(
+            host,
+            port,
+            username,
+            password,
+            [
+                (os.path.join(output_dir, name), f"{remote_dir}/{name}")
+                for name in pending
+            ],
+            on_success=record,
+            log_file=log_file,
+        )
+        failed = {os.path.basename(local_file) for local_file, _ in failures}
+        pushed.extend(name for name in pending if name not in failed)
+        pending = [name for name in pending if name in failed]
+        if pending:
+            logger.log(f"EXPORT: {len(pending)} SHARDS FAILED ON ATTEMPT {attempt + 1}")
+
+    if not pending:
+        # the manifest goes last so its presence means every shard is in place
+        for attempt in range(retries + 1):
+            failures = sftp_push_files(
+                host,
+                port,
+                username,
+                password,
+                [(manifest_path, f"{remote_dir}/{MANIFEST_NAME}")],
+                log_file=log_file,
+            )
+            if not failures:
+                break
+        if failures:
+            logger.log(f"EXPORT: MANIFEST FAILED AFTER {retries + 1} ATTEMPTS")
+            pending = [MANIFEST_NAME]
+        elif os.path.exists(state_path):
+            # snapshot delivered - the next run pushes its snapshot in full
+            os.remove(state_path)
+    logger.log(
+        f"EXPORT: PUSHED {len(pushed)} SHARDS, SKIPPED {len(skipped)} ALREADY PUSHED, "
+        f"{len(pending)} FAILED"
+    )
+    return {"pushed": pushed, "skipped": skipped, "failed": pending}
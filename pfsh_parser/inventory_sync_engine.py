@@ -0,0 +1,330 @@
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Optional
+
+import pandas as pd
+
+from pfsh_parser.catalog_schema import price_to_decimal
+from pfsh_parser.creds import LOG_FILE
+from pfsh_parser.log_engine import LogEngine
+
+# page size for reading variants - 100 keeps the query cost well under the 1000 point limit
+VARIANT_PAGE_SIZE = 100
+# inventorySetQuantities accepts at most 250 quantities per call
+QUANTITY_BATCH_SIZE = 250
+
+VARIANTS_QUERY = """
+query ($cursor: String, $locationId: ID!, $pageSize: Int!) {
+  productVariants(first: $pageSize, after: $cursor) {
+    pageInfo { hasNextPage endCursor }
+    nodes {
+      id
+      sku
+      product { id }
+      inventoryItem {
+        id
+        unitCost { amount }
+        inventoryLevel(locationId: $locationId) {
+          quantities(names: ["available"]) { quantity }
+        }
+      }
+    }
+  }
+}
+"""
+
+LOCATION_QUERY = """
+query {
+  locations(first: 1, query: "active:true") { nodes { id name } }
+}
+"""
+
+SET_QUANTITIES_MUTATION = """
+mutation ($input: InventorySetQuantitiesInput!) {
+  inventorySetQuantities(input: $input) {
+    userErrors { code field message }
+  }
+}
+"""
+
+UPDATE_COSTS_MUTATION = """
+mutation ($productId: ID!, $variants: [ProductVariantsBulkInput!]!) {
+  productVariantsBulkUpdate(productId: $productId, variants: $variants) {
+    userErrors { field message }
+  }
+}
+"""
+
+
+@dataclass(frozen=True, slots=True)
+class VariantState:
+    sku: str
+    variant_id: str
+    product_id: str
+    inventory_item_id: str
+    available: Optional[int]
+    cost: Optional[Decimal]
+
+
+@dataclass(frozen=True, slots=True)
+class QuantityChange:
+    sku: str
+    inventory_item_id: str
+    before: Optional[int]
+    after: int
+
+
+@dataclass(frozen=True, slots=True)
+class CostChange:
+    sku: str
+    product_id: str
+    variant_id: str
+    before: Optional[Decimal]
+    after: Decimal
+
+
+@dataclass
+class SyncReport:
+    dry_run: bool = False
+    variants: int = 0
+    catalog_rows: int = 0
+    missing_skus: list = field(default_factory=list)
+    quantity_changes: int = 0
+    cost_changes: int = 0
+    applied: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)
+
+    def summary(self) -> str:
+        prefix = "DRY RUN - " if self.dry_run else ""
+        return (
+            f"{prefix}{self.catalog_rows} catalog rows against {self.variants} Shopify variants: "
+            f"{self.quantity_changes} quantity and {self.cost_changes} cost changes, "
+            f"{self.applied} applied, {self.failed} failed, "
+            f"{len(self.missing_skus)} SKUs not in Shopify"
+        )
+
+
+class InventorySync:
+    def __init__(
+        self,
+        sh_client,
+        location_id: Optional[str] = None,
+        dry_run: bool = False,
+        batch_size: int = QUANTITY_BATCH_SIZE,
+        log_file: str = LOG_FILE,
+    ):
+        """
+        Push quantity and cost changes from the merged inventory straight to Shopify.
+
+        Args:
+            sh_client (ShopifyClient): Client used for the GraphQL calls.
+            location_id (Optional[str]): Location to set quantities at, numeric or gid.
+                Defaults to the first active location of the shop.
+            dry_run (bool): Work out and log the changes without sending any mutations.
+            batch_size (int): Number of quantities sent per inventorySetQuantities call.
+            log_file (str): Log the sync is written to.
+        """
+        self.sh_client = sh_client
+        self.location_id = location_id
+        self.dry_run = dry_run
+        self.batch_size = min(batch_size, QUANTITY_BATCH_SIZE)
+        self.logger = LogEngine(file_path=log_file)
+
+    def _location_gid(self) -> str:
+        if self.location_id:
+            location_id = str(self.location_id)
+            if location_id.startswith("gid://"):
+                return location_id
+            return f"gid://shopify/Location/{location_id}"
+        locations = self.sh_client.graphql(LOCATION_QUERY)["locations"]["nodes"]
+        if not locations:
+            raise Exception("NO ACTIVE SHOPIFY LOCATION FOUND")
+        self.location_id = locations[0]["id"]
+        return self.location_id
+
+    def fetch_variants(self, location_gid: str) -> dict:
+        """Read every variant's current quantity and cost, keyed by SKU."""
+        variants = {}
+        cursor = None
+        while True:
+            data = self.sh_client.graphql(
+                VARIANTS_QUERY,
+                {
+                    "cursor": cursor,
+                    "locationId": location_gid,
+                    "pageSize": VARIANT_PAGE_SIZE,
+                },
+            )["productVariants"]
+            for node in data["nodes"]:
+                if not node.get("sku"):
+                    continue
+                item = node["inventoryItem"]
+                level = item.get("inventoryLevel")
+                available = None
+                if level and level["quantities"]:
+                    available = level["quantities"][0]["quantity"]
+                cost = None
+                if item.get("unitCost"):
+                    cost = Decimal(item["unitCost"]["amount"]).quantize(Decimal("0.01"))
+                variants[node["sku"].strip()] = VariantState(
+                    sku=node["sku"].strip(),
+                    variant_id=node["id"],
+                    product_id=node["product"]["id"],
+                    inventory_item_id=item["id"],
+                    available=available,
+                    cost=cost,
+                )
+            if not data["pageInfo"]["hasNextPage"]:
+                return variants
+            cursor = data["pageInfo"]["endCursor"]
+
+    def compute_changes(self, inventory_df: pd.DataFrame, variants: dict, report):
+        """
+        Compare the merged inventory with Shopify and return what needs to change.
+
+        Returns:
+            tuple: (list of QuantityChange, list of CostChange)
+        """
+        quantity_changes = []
+        cost_changes = []
+        columns = list(inventory_df.columns)
+        sku_position = columns.index("Variant SKU [ID]")
+        quantity_position = columns.index("Variant Inventory Qty")
+        cost_position = None
+        if "Variant Cost" in columns:
+            cost_position = columns.index("Variant Cost")
+
+        for row in inventory_df.itertuples(index=False, name=None):
+            sku = row[sku_position]
+            if pd.isna(sku):
+                continue
+            sku = str(sku).strip()
+            state = variants.get(sku)
+            if state is None:
+                report.missing_skus.append(sku)
+                continue
+            quantity = row[quantity_position]
+            if pd.notna(quantity) and int(quantity) != state.available:
+                quantity_changes.append(
+                    QuantityChange(
+                        sku, state.inventory_item_id, state.available, int(quantity)
+                    )
+                )
+            if cost_position is not None and pd.notna(row[cost_position]):
+                cost = price_to_decimal(row[cost_position])
+                if cost != state.cost:
+                    cost_changes.append(
+                        CostChange(
+                            sku, state.product_id, state.variant_id, state.cost, cost
+                        )
+                    )
+        return quantity_changes, cost_changes
+
+    def push_quantities(self, changes: list, location_gid: str, report):
+        for start in range(0, len(changes), self.batch_size):
+            batch = changes[start : start + self.batch_size]
+            failed = self._set_quantities(batch, location_gid, report)
+            report.applied += len(batch) - failed
+            report.failed += failed
+
+    def _set_quantities(self, batch: list, location_gid: str, report) -> int:
+        """Send one batch, returns how many of its changes failed."""
+        variables = {
+            "input": {
+                "name": "available",
+                "reason": "correction",
+                "ignoreCompareQuantity": True,
+                "quantities": [
+                    {
+                        "inventoryItemId": change.inventory_item_id,
+                        "locationId": location_gid,
+                        "quantity": change.after,
+                    }
+                    for change in batch
+                ],
+            }
+        }
+        try:
+            result = self.sh_client.graphql(SET_QUANTITIES_MUTATION, variables)
+        except Exception as e:
+            report.errors.append(str(e))
+            return len(batch)
+        user_errors = result["inventorySetQuantities"]["userErrors"]
+        if not user_errors:
+            return 0
+
+        # the mutation is all or nothing - drop the changes it complained about and resend the rest
+        bad = set()
+        for error in user_errors:
+            report.errors.append(f"{error.get('field')}: {error.get('message')}")
+            path = error.get("field") or []
+            if len(path) > 2 and path[1] == "quantities" and str(path[2]).isdigit():
+                bad.add(int(path[2]))
+        if not bad or len(bad) == len(batch):
+            return len(batch)
+        remaining = [change for index, change in enumerate(batch) if index not in bad]
+        return len(bad) + self._set_quantities(remaining, location_gid, report)
+
+    def push_costs(self, changes: list, report):
+        # cost lives on the inventory item, which productVariantsBulkUpdate sets per product
+        by_product = {}
+        for change in changes:
+            by_product.setdefault(change.product_id, []).append(change)
+        for product_id, product_changes in by_product.items():
+            variables = {
+                "productId": product_id,
+                "variants": [
+                    {
+                        "id": change.variant_id,
+                        "inventoryItem": {"cost": str(change.after)},
+                    }
+                    for change in product_changes
+                ],
+            }
+            try:
+                result = self.sh_client.graphql(UPDATE_COSTS_MUTATION, variables)
+                user_errors = result["productVariantsBulkUpdate"]["userErrors"]
+            except Exception as e:
+                user_errors = [{"field": product_id, "message": str(e)}]
+            if user_errors:
+                report.errors.extend(
+                    f"{error.get('field')}: {error.get('message')}"
+                    for error in user_errors
+                )
+                report.failed += len(product_changes)
+            else:
+                report.applied += len(product_changes)
+
+    def run(self, inventory_df: pd.DataFrame) -> SyncReport:
+        """
+        Sync the merged inventory (the frame daily_inventory_parser returns) to Shopify.
+
+        Returns:
+            SyncReport: What changed, what was applied and what failed.
+        """
+        report = SyncReport(dry_run=self.dry_run, catalog_rows=len(inventory_df))
+        location_gid = self._location_gid()
+        self.logger.log(f"SYNC: READING SHOPIFY VARIANTS AT {location_gid}")
+        variants = self.fetch_variants(location_gid)
+        report.variants = len(variants)
+
+        quantity_changes, cost_changes = self.compute_changes(
+            inventory_df, variants, report
+        )
+        report.quantity_changes = len(quantity_changes)
+        report.cost_changes = len(cost_changes)
+
+        if self.dry_run:
+            for change in quantity_changes:
+                print(
+                    f"DRY RUN: {change.sku} quantity {change.before} -> {change.after}"
+                )
+            for change in cost_changes:
+                print(f"DRY RUN: {change.sku} cost {change.before} -> {change.after}")
+        else:
+            self.push_quantities(quantity_changes, location_gid, report)
+            self.push_costs(cost_changes, report)
+
+        self.logger.log(f"SYNC: {report.summary()}")
+        return report
@@ -0,0 +1,128 @@
+import csv
+import os
+
+# column layout of the PO file Sheralven imports
+ORDER_COLUMNS = [
+    "PONUMBER",
+    "ITEM",
+    "QTYORDERED",
+    "ORDUNIT",
+    "SHPNAME(30)",
+    "SHPADDR1(30) - DO NOT LEAVE BLANK",
+    "SHPADDR2(30)",
+    "SHPCITY(16)",
+    "SHPSTATE(2)",
+    "SHPCOUNTRY(3)",
+    "SHPZIP(10)",
+    "SHIPVIA",
+    "PRIUNTPRC",
+]
+
+
+def journal_path_for(path: str) -> str:
+    return f"{path}.journal"
+
+
+def discard_order_output(path: str):
+    """Remove an orders file and its journal once the file has been delivered."""
+    for file_path in (path, journal_path_for(path)):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+class OrderCsvWriter:
+    def __init__(self, path: str, columns: list = ORDER_COLUMNS):
+        """
+        Append-only writer for the orders CSV that survives a crash part way through a run.
+
+        Each order's rows are written and synced to disk as soon as the order is
+        processed, then its PO number is added to a journal together with the
+        file size at that point. Opening the writer again resumes from the
+        journal: anything written after the last committed order is cut off and
+        committed orders can be skipped with is_committed.
+
+        Args:
+            path (str): The CSV file to write.
+            columns (list): The CSV header.
+        """
+        self.path = path
+        self.journal_path = journal_path_for(path)
+        self.columns = columns
+        # PO number -> number of rows it wrote
+        self.committed = {}
+        self.rows_written = 0
+        self._file = None
+        self._journal = None
+        self._recover()
+
+    def _recover(self):
+        offset = 0
+        journal_length = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "rb") as journal:
+                for line in journal:
+                    if not line.endswith(b"\n"):
+                        break  # the run died while writing this entry
+                    po_number, end_offset, rows = line.decode().rstrip("\n").split("\t")
+                    self.committed[po_number] = int(rows)
+                    offset = int(end_offset)
+                    journal_length += len(line)
+
+        if not offset or not os.path.exists(self.path):
+            # nothing usable to resume from - start over
+            self.committed = {}
+            discard_order_output(self.path)
+            return
+        with open(self.journal_path, "r+b") as journal:
+            journal.truncate(journal_length)
+        # drop rows of an order that was being written when the run stopped
+        with open(self.path, "r+b") as file:
+            file.truncate(offset)
+
+    @property
+    def total_rows(self) -> int:
+        """Rows in the file, including orders committed by an earlier run."""
+        return sum(self.committed.values())
+
+    def is_committed(self, po_number) -> bool:
+        return str(po_number) in self.committed
+
+    def _open(self):
+        new_file = not os.path.exists(self.path)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(
+            self._file, fieldnames=self.columns, lineterminator="\n"
+        )
+        if new_file:
+            self._writer.writeheader()
+        self._journal = open(self.journal_path, "a")
+
+    def write_order(self, po_number, rows: list):
+        """Append the rows of one order and commit its PO number to the journal."""
+        if not rows:
+            return
+        if self._file is None:
+            self._open()
+        self._writer.writerows(rows)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        self._journal.write(f"{po_number}\t{self._file.tell()}\t{len(rows)}\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self.committed[str(po_number)] = len(rows)
+        self.rows_written += len(rows)
+
+    def close(self):
+        for handle in (self._file, self._journal):
+            if handle is not None:
+                handle.close()
+        self._file = None
+        self._journal = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
@@ -0,0 +1,297 @@
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import requests
+
+from pfsh_parser.creds import LOG_FILE
+from pfsh_parser.log_engine import LogEngine
+
+OUTBOX_DB = "files/state/outbox.db"
+# REST Admin API leaky bucket: 40 requests, refilled at 2 per second - stay below it
+# so the reads the jobs make in between have room too
+REST_RATE = 2.0
+REST_BURST = 20
+
+CREATE_FULFILLMENT = "create_fulfillment"
+UPDATE_TRACKING = "update_tracking"
+CLOSE_ORDER = "close_order"
+# mutations of an order depend on the earlier ones, so kinds are flushed in this order
+FLUSH_ORDER = (CREATE_FULFILLMENT, UPDATE_TRACKING, CLOSE_ORDER)
+
+
+@dataclass(frozen=True, slots=True)
+class Mutation:
+    kind: str
+    key: str
+    order_id: int
+    args: tuple
+
+
+@dataclass
+class OutboxReport:
+    queued: int = 0
+    # writes that were not sent because the same one was already queued
+    duplicates: int = 0
+    # writes that were not sent because an earlier run completed them
+    already_done: int = 0
+    applied: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)
+    # orders with at least one mutation that failed
+    failed_orders: set = field(default_factory=set)
+
+    @property
+    def saved(self) -> int:
+        return self.duplicates + self.already_done
+
+    def summary(self) -> str:
+        return (
+            f"{self.queued} writes queued, {self.applied} applied, {self.failed} failed, "
+            f"{self.saved} saved ({self.duplicates} duplicates, "
+            f"{self.already_done} already done by an earlier run)"
+        )
+
+
+class RateLimiter:
+    def __init__(self, rate: float = REST_RATE, burst: int = REST_BURST):
+        """
+        Token bucket shared by the threads of a flush.
+
+        Args:
+            rate (float): Requests allowed per second on average.
+            burst (int): Requests that can be sent at once after a quiet period.
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class MutationOutbox:
+    def __init__(
+        self,
+        sh_client,
+        db_path: str = OUTBOX_DB,
+        max_workers: int = 4,
+        batch_size: int = 50,
+        rate_limiter: RateLimiter = None,
+        retries: int = 3,
+        log_file: str = LOG_FILE,
+    ):
+        """
+        Write-behind outbox for the Shopify mutations of a run.
+
+        Mutations are collected first and keyed by what they change - the
+        fulfillment order for fulfillments, the order for closes, the fulfillment
+        and tracking number for tracking updates - so repeats are dropped before
+        anything is sent.
+        flush() sends them in batches from a thread pool, paced by the rate
+        limiter. Completed keys are stored in sqlite, so a rerun does not repeat
+        writes that already went through.
+
+        Args:
+            sh_client (ShopifyClient): Client the mutations are sent with. Give it a
+                pool_size of at least max_workers.
+            db_path (str): Location of the sqlite database of completed keys.
+            max_workers (int): Mutations sent at the same time.
+            batch_size (int): Mutations sent before their keys are stored.
+            rate_limiter (RateLimiter): Paces the requests, a REST API sized one by default.
+            retries (int): Times a mutation is retried after a 429 response.
+            log_file (str): Log failed mutations are written to.
+        """
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.sh_client = sh_client
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retries = retries
+        self.report = OutboxReport()
+        self.logger = LogEngine(file_path=log_file)
+        # key -> Mutation, in the order they were added
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS completed (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                order_id INTEGER NOT NULL,
+                completed_at REAL NOT NULL
+            )
+            """
+        )
+
+    def is_done(self, key: str) -> bool:
+        with self._lock:
+            return (
+                self.conn.execute(
+                    "SELECT 1 FROM completed WHERE key = ?", (key,)
+                ).fetchone()
+                is not None
+            )
+
+    def _add(self, kind: str, key: str, order_id, args: tuple) -> bool:
+        if key in self._pending:
+            self.report.duplicates += 1
+            return False
+        if self.is_done(key):
+            self.report.already_done += 1
+            return False
+        self._pending[key] = Mutation(kind, key, int(order_id), args)
+        self.report.queued += 1
+        return True
+
+    def create_fulfillment(self, order_id, fulfillment_orders) -> bool:
+        """
+        Queue fulfilling the open fulfillment orders of an order, one write each.
+
+        Fulfillment orders that are not open (on hold, scheduled, closed) are
+        left out, so they are fulfilled by a later run once they open.
+
+        Returns:
+            bool: False if nothing was queued - no fulfillment order was open, or
+            every open one was a duplicate or already done.
+        """
+        queued = False
+        for fulfillment_order in fulfillment_orders:
+            if not fulfillment_order.is_open:
+                continue
+            queued |= self._add(
+                CREATE_FULFILLMENT,
+                f"{CREATE_FULFILLMENT}:{fulfillment_order.id}",
+                order_id,
+                ((fulfillment_order,),),
+            )
+        return queued
+
+    def update_tracking(self, order_id, fulfillment_id, tracking_number) -> bool:
+        """Queue setting the tracking number of a fulfillment."""
+        tracking_number = str(tracking_number).strip()
+        return self._add(
+            UPDATE_TRACKING,
+            f"{UPDATE_TRACKING}:{fulfillment_id}:{tracking_number}",
+            order_id,
+            (fulfillment_id, tracking_number),
+        )
+
+    def close_order(self, order_id) -> bool:
+        """Queue closing an order, sent after its tracking updates went through."""
+        return self._add(CLOSE_ORDER, f"{CLOSE_ORDER}:{order_id}", order_id, ())
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def _send(self, mutation: Mutation):
+        if mutation.kind == CREATE_FULFILLMENT:
+            return self.sh_client.create_fulfillment(*mutation.args)
+        if mutation.kind == UPDATE_TRACKING:
+            return self.sh_client.update_fulfillment_shipping(*mutation.args)
+        return self.sh_client.close_order(mutation.order_id)
+
+    def _apply(self, mutation: Mutation):
+        """Send one mutation, returns None on success or the error message."""
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                self._send(mutation)
+                return None
+            except requests.HTTPError as e:
+                response = e.response
+                if (
+                    response is None
+                    or response.status_code != 429
+                    or attempt == self.retries
+                ):
+                    return f"{mutation.key}: {e}"
+                time.sleep(float(response.headers.get("Retry-After") or 2))
+            except Exception as e:
+                return f"{mutation.key}: {e}"
+
+    def _mark_done(self, mutations: list):
+        now = time.time()
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO completed (key, kind, order_id, completed_at) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (mutation.key, mutation.kind, mutation.order_id, now)
+                    for mutation in mutations
+                ],
+            )
+
+    def flush(self) -> set:
+        """
+        Send every pending mutation.
+
+        Fulfillments go first, then tracking updates, then closes. An order is
+        only closed once all of its tracking updates went through.
+
+        Returns:
+            set: Keys of the mutations that failed - they stay out of the
+            completed table and are tried again on the next run.
+        """
+        pending = list(self._pending.values())
+        self._pending = {}
+        failed_keys = set()
+        failed_orders = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for kind in FLUSH_ORDER:
+                mutations = [mutation for mutation in pending if mutation.kind == kind]
+                if kind == CLOSE_ORDER:
+                    blocked = [m for m in mutations if m.order_id in failed_orders]
+                    for mutation in blocked:
+                        failed_keys.add(mutation.key)
+                        self.report.failed_orders.add(mutation.order_id)
+                        self._record_error(f"{mutation.key}: tracking not updated")
+                    self.report.failed += len(blocked)
+                    mutations = [
+                        m for m in mutations if m.order_id not in failed_orders
+                    ]
+
+                for start in range(0, len(mutations), self.batch_size):
+                    batch = mutations[start : start + self.batch_size]
+                    done = []
+                    for mutation, error in zip(batch, executor.map(self._apply, batch)):
+                        if error is None:
+                            done.append(mutation)
+                            continue
+                        failed_keys.add(mutation.key)
+                        failed_orders.add(mutation.order_id)
+                        self.report.failed_orders.add(mutation.order_id)
+                        self._record_error(error)
+                    self._mark_done(done)
+                    self.report.applied += len(done)
+                    self.report.failed += len(batch) - len(done)
+
+        return failed_keys
+
+    def _record_error(self, error: str):
+        self.report.errors.append(error)
+        self.logger.log(f"OUTBOX: FAILED {error}")
+
+    def close(self):
+        self.conn.close()
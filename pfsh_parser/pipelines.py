@@ -0,0 +1,213 @@
+import os
+import time
+
+from pfsh_parser.tenant_engine import TenantConfig
+
+# Every setting and path the engines use is passed in from the tenant. The engines
+# still import creds.py for their defaults, so they are imported inside each
+# pipeline - after the tenant's environment has been applied.
+
+
+def run_inventory(tenant: TenantConfig) -> dict:
+    """Pull the supplier feed, merge it into the master catalog and publish it."""
+    from pfsh_parser.csv_engine import daily_inventory_parser
+    from pfsh_parser.export_engine import push_sharded_export, write_sharded_export
+    from pfsh_parser.inventory_sync_engine import InventorySync
+    from pfsh_parser.log_engine import LogEngine
+    from pfsh_parser.sftp_engine import sftp_connect
+    from pfsh_parser.shopify_engine import ShopifyClient
+    from pfsh_parser.sku_index import SKU_INDEX_FILE
+
+    # LOCAL_FILE,REMOTE_FILE,LOG_FILE
+    # get latest inventory File
+    logger = LogEngine(file_path=tenant.log_file)
+    logger.log(f"PULLING BASE INVENTORY FILE FROM SFTP")
+    sftp_connect(
+        host=tenant.sftp_host,
+        port=tenant.sftp_port,
+        username=tenant.sftp_username,
+        password=tenant.sftp_password,
+        direction="pull",
+        # GRAB THE FILE AND SAVE A COPY TO LOCAL FILES DIR
+        remote_file=f"Inventory/{tenant.base_inventory_file}",
+        local_file=tenant.path("files", tenant.base_inventory_file),
+        log_file=tenant.log_file,
+    )
+    logger.log(f"ATTEMPING FILE PARSING")
+    base_file = tenant.path("files", tenant.base_inventory_file)
+    master_file = tenant.path("files", tenant.master_inventory_file)
+    parser_options = {
+        "log_file": tenant.log_file,
+        "sku_index_file": tenant.path(SKU_INDEX_FILE),
+    }
+    # modify file for matrixify
+    if tenant.inventory_export_mode == "api":
+        inventory_df = daily_inventory_parser(
+            base_file, master_file, output_file=None, **parser_options
+        )
+        logger.log("SYNCING INVENTORY DIRECTLY TO SHOPIFY")
+        report = InventorySync(
+            ShopifyClient(tenant.shop_name, tenant.access_token),
+            location_id=tenant.shopify_location_id,
+            dry_run=tenant.inventory_sync_dry_run,
+            log_file=tenant.log_file,
+        ).run(inventory_df)
+        print(report.summary())
+        if report.failed:
+            raise Exception(f"FAILED TO SYNC {report.failed} INVENTORY CHANGES")
+        return {
+            "mode": "api",
+            "rows": len(inventory_df),
+            "applied": report.applied,
+            "missing_skus": len(report.missing_skus),
+        }
+    elif tenant.inventory_export_mode == "sharded":
+        inventory_df = daily_inventory_parser(
+            base_file, master_file, output_file=None, **parser_options
+        )
+        manifest_path = write_sharded_export(
+            inventory_df,
+            tenant.path("files", "tmp", "inventory_shards"),
+            max_rows=tenant.inventory_shard_rows,
+            shard_by=tenant.inventory_shard_by,
+            log_file=tenant.log_file,
+        )
+        logger.log("PUTTING INVENTORY SHARDS ON SFTP")
+        result = push_sharded_export(
+            manifest_path,
+            "imports/inventory",
+            host=tenant.sftp_host,
+            port=tenant.sftp_port,
+            username=tenant.sftp_username,
+            password=tenant.sftp_password,
+            log_file=tenant.log_file,
+        )
+        if result["failed"]:
+            raise Exception(f"FAILED TO PUSH INVENTORY SHARDS {result['failed']}")
+        return {
+            "mode": "sharded",
+            "rows": len(inventory_df),
+            "pushed": len(result["pushed"]),
+        }
+    else:
+        updated_file = tenant.path("files", "tmp", tenant.updated_inventory_file)
+        inventory_df = daily_inventory_parser(
+            base_file, master_file, output_file=updated_file, **parser_options
+        )
+        logger.log("PUTTING MODIFIED FILE ON SFTP")
+        # Put modified file on sftp server
+        time.sleep(1)
+        sftp_connect(
+            host=tenant.sftp_host,
+            port=tenant.sftp_port,
+            username=tenant.sftp_username,
+            password=tenant.sftp_password,
+            direction="push",
+            local_file=updated_file,
+            remote_file=f"imports/inventory/{tenant.updated_inventory_file}",
+            log_file=tenant.log_file,
+        )
+        return {"mode": "single", "rows": len(inventory_df)}
+
+
+def run_orders(tenant: TenantConfig) -> dict:
+    """Fulfill open Shopify orders and push the PO file for the supplier."""
+    from pfsh_parser.csv_engine import new_mail_queue, order_parser
+    from pfsh_parser.log_engine import LogEngine
+    from pfsh_parser.order_writer import discard_order_output
+    from pfsh_parser.outbox_engine import OUTBOX_DB
+    from pfsh_parser.sftp_engine import sftp_connect
+    from pfsh_parser.sku_index import SKU_INDEX_FILE
+
+    orders_file = tenant.path("files", "tmp", tenant.updated_orders_file)
+    logger = LogEngine(file_path=tenant.log_file)
+    logger.log(f"Fetching Orders from Shopify API")
+    mail_queue = new_mail_queue(
+        smtp_server=tenant.email_server,
+        smtp_port=tenant.email_port,
+        username=tenant.email_sender,
+        password=tenant.email_password,
+    )
+    try:
+        report = order_parser(
+            tenant.shop_name,
+            "open",
+            tenant.access_token,
+            output_file=orders_file,
+            log_file=tenant.log_file,
+            master_file=tenant.path("files", tenant.master_inventory_file),
+            sku_index_file=tenant.path(SKU_INDEX_FILE),
+            outbox_db=tenant.path(OUTBOX_DB),
+            mail_queue=mail_queue,
+            email_sender=tenant.email_sender,
+            recipient_list=tenant.recipient_list,
+        )
+    finally:
+        # risky order alerts go out in the background - make sure they are sent
+        mail_queue.close()
+    logger.log(f"PUSH MODIFIED ORDERS FILE TO SFTP")
+    pushed = False
+    # push new orders
+    if os.path.exists(orders_file):
+        print("Update orders file was found - pushing to FTP")
+        time.sleep(1)
+        sftp_connect(
+            host=tenant.sftp_host,
+            port=tenant.sftp_port,
+            username=tenant.sftp_username,
+            password=tenant.sftp_password,
+            direction="push",
+            local_file=orders_file,
+            remote_file=f"Orders/POSTFORDERS.csv",
+            log_file=tenant.log_file,
+        )
+        # delivered - the next run starts a fresh file and journal
+        discard_order_output(orders_file)
+        pushed = True
+    else:
+        print("No Orders file found - skipping")
+    if report.failed:
+        # the other orders went out - these are tried again by the next run
+        raise Exception(f"FAILED TO PROCESS ORDERS {report.failed}")
+    return {"rows": report.rows, "pushed": pushed, "deferred": len(report.deferred)}
+
+
+def run_shipping(tenant: TenantConfig) -> dict:
+    """Pull the supplier shipping file and add its tracking numbers in Shopify."""
+    from pfsh_parser.csv_engine import shipping_parser
+    from pfsh_parser.log_engine import LogEngine
+    from pfsh_parser.outbox_engine import OUTBOX_DB
+    from pfsh_parser.sftp_engine import sftp_connect
+
+    shipping_file = tenant.path("files", "tmp", tenant.shipping_file)
+    logger = LogEngine(file_path=tenant.log_file)
+    logger.log(f"PULLING SHIPPING FILE")
+
+    time.sleep(1)
+    sftp_connect(
+        host=tenant.sftp_host,
+        port=tenant.sftp_port,
+        username=tenant.sftp_username,
+        password=tenant.sftp_password,
+        direction="pull",
+        local_file=shipping_file,
+        remote_file=f"Shipping/{tenant.shipping_file}",
+        log_file=tenant.log_file,
+    )
+    logger.log("UPDATING TRACKING INFORMATION FROM CSV TO SHOPIFY")
+    # update Tracking information
+    shipping_parser(
+        shipping_file,
+        tenant.shop_name,
+        tenant.access_token,
+        log_file=tenant.log_file,
+        outbox_db=tenant.path(OUTBOX_DB),
+    )
+    return {}
+
+
+PIPELINES = {
+    "inventory": run_inventory,
+    "orders": run_orders,
+    "shipping": run_shipping,
+}
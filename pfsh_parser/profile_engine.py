@@ -0,0 +1,170 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from pfsh_parser.creds import LOG_FILE, PFSH_PROFILE, PFSH_PROFILE_DIR
+from pfsh_parser.log_engine import LogEngine
+
+# one artifacts folder per process run, stages are numbered in the order they ran
+RUN_ID = datetime.now().strftime("%Y%m%d-%H%M%S")
+_stage_counter = 0
+_active_stages = threading.local()
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    marker = "site-packages" + os.sep
+    if marker in filename:
+        filename = filename.split(marker, 1)[1]
+    elif filename.startswith(os.getcwd()):
+        filename = os.path.relpath(filename)
+    else:
+        filename = os.path.basename(filename)
+    # ";" separates frames in the collapsed format
+    return f"{filename}:{code.co_name}".replace(";", ":")
+
+
+class StackSampler:
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        """
+        Sample the call stack of one thread at a fixed interval.
+
+        Sampling keeps the overhead low enough for a production run, and time
+        spent waiting on sockets shows up under the call that is blocked.
+
+        Args:
+            thread_id (int): The thread to sample.
+            interval (float): Seconds between samples.
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[";".join(stack)] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        """Stacks in the collapsed format flamegraph.pl and speedscope read."""
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def ranked(self, limit: int = 25):
+        """Return (self counts, total counts) of the most sampled functions."""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            # a recursive function only counts once per sample
+            for label in set(frames):
+                total[label] += count
+        return own.most_common(limit), total.most_common(limit)
+
+
+def _write_report(stage_dir, name, elapsed, sampler, memory):
+    lines = [
+        f"stage: {name}",
+        f"wall time: {elapsed:.2f}s",
+        f"samples: {sampler.samples}",
+    ]
+    own, total = sampler.ranked()
+    for title, ranking in (("self", own), ("total", total)):
+        lines.append("")
+        lines.append(f"top functions by {title} time")
+        for label, count in ranking:
+            share = count / sampler.samples if sampler.samples else 0
+            lines.append(f"{share:7.1%} {count * sampler.interval:8.2f}s  {label}")
+    if memory is not None:
+        current, peak, top_stats = memory
+        lines.append("")
+        lines.append(
+            f"memory: peak {peak / 2**20:.1f}MiB, still allocated at end {current / 2**20:.1f}MiB"
+        )
+        lines.append("top allocations still held at end of stage")
+        for stat in top_stats:
+            frame = stat.traceback[0]
+            lines.append(
+                f"{stat.size / 2**20:9.2f}MiB {stat.count:9d} blocks  "
+                f"{frame.filename}:{frame.lineno}"
+            )
+
+    with open(os.path.join(stage_dir, f"{name}.collapsed"), "w") as file:
+        file.write(sampler.collapsed())
+    with open(os.path.join(stage_dir, f"{name}.txt"), "w") as file:
+        file.write("\n".join(lines) + "\n")
+
+
+@contextmanager
+def profile_stage(stage: str):
+    """
+    Profile a pipeline stage when PFSH_PROFILE is set, otherwise do nothing.
+
+    Writes <stage>.collapsed (flamegraph compatible stacks) and <stage>.txt
+    (ranked hot spots plus tracemalloc peak and top allocations) to
+    PFSH_PROFILE_DIR/<run id>/. PFSH_PROFILE=cpu skips the memory tracing.
+    Stages nested inside a profiled stage are folded into the outer one.
+    """
+    if not PFSH_PROFILE or getattr(_active_stages, "name", None):
+        yield
+        return
+
+    global _stage_counter
+    _stage_counter += 1
+    name = f"{_stage_counter:02d}_{stage}"
+    stage_dir = os.path.join(PFSH_PROFILE_DIR, RUN_ID)
+    os.makedirs(stage_dir, exist_ok=True)
+
+    trace_memory = PFSH_PROFILE != "cpu"
+    # tracing slows every allocation down, so it is only on while a stage runs
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if trace_memory:
+        tracemalloc.reset_peak()
+    sampler = StackSampler(threading.get_ident())
+    _active_stages.name = name
+    started = time.perf_counter()
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        elapsed = time.perf_counter() - started
+        _active_stages.name = None
+        memory = None
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            top_stats = tracemalloc.take_snapshot().statistics("lineno")[:15]
+            memory = (current, peak, top_stats)
+        if started_tracing:
+            tracemalloc.stop()
+        _write_report(stage_dir, name, elapsed, sampler, memory)
+        LogEngine(file_path=LOG_FILE).log(
+            f"PROFILE: {name} took {elapsed:.2f}s - report in {stage_dir}"
+        )
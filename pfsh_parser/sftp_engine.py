@@ -1,26 +1,73 @@
 import paramiko
 from pfsh_parser.creds import LOG_FILE
 from pfsh_parser.log_engine import LogEngine
+from pfsh_parser.profile_engine import profile_stage
 
 
 def sftp_connect(
-    host, port, username, password, direction, local_file=None, remote_file=None
+    host,
+    port,
+    username,
+    password,
+    direction,
+    local_file=None,
+    remote_file=None,
+    log_file=LOG_FILE,
 ):
-    logger = LogEngine(file_path=LOG_FILE)
-    transport = paramiko.Transport(str(host), int(port))
-    transport.connect(username=str(username), password=str(password))
-    sftp = paramiko.SFTPClient.from_transport(transport)
-
-    # Download or upload a file depending on direction
-    logger.log("PULLING DAILY INVENTORY UPDATE FILE FROM SFTP")
-    if direction == "pull":
-        print(f"Pulling file {remote_file} to {local_file}")
-        sftp.get(remote_file, local_file)
-    else:
-        logger.log("PUSHING UPDATED INVENTORY FILE TO SFTP")
-        print(f"Pushing file {local_file} to {remote_file}")
-        sftp.put(local_file, remote_file)
-
-    # Close the SFTP session and transport
-    sftp.close()
-    transport.close()
+    logger = LogEngine(file_path=log_file)
+    with profile_stage(f"sftp_{direction}"):
+        transport = paramiko.Transport(str(host), int(port))
+        transport.connect(username=str(username), password=str(password))
+        sftp = paramiko.SFTPClient.from_transport(transport)
+
+        # Download or upload a file depending on direction
+        logger.log("PULLING DAILY INVENTORY UPDATE FILE FROM SFTP")
+        if direction == "pull":
+            print(f"Pulling file {remote_file} to {local_file}")
+            sftp.get(remote_file, local_file)
+        else:
+            logger.log("PUSHING UPDATED INVENTORY FILE TO SFTP")
+            print(f"Pushing file {local_file} to {remote_file}")
+            sftp.put(local_file, remote_file)
+
+        # Close the SFTP session and transport
+        sftp.close()
+        transport.close()
+
+
+def sftp_push_files(
+    host, port, username, password, file_pairs, on_success=None, log_file=LOG_FILE
+):
+    """
+    Push several files over a single SFTP connection.
+
+    A failed upload doesn't stop the others. on_success is called with
+    (local_file, remote_file) after each upload that went through.
+
+    Returns a list of (local_file, error) for the uploads that failed.
+    """
+    logger = LogEngine(file_path=log_file)
+    failures = []
+    try:
+        transport = paramiko.Transport(str(host), int(port))
+        transport.connect(username=str(username), password=str(password))
+        sftp = paramiko.SFTPClient.from_transport(transport)
+    except Exception as e:
+        logger.log(f"SFTP CONNECTION FAILED: {e}")
+        return [(local_file, e) for local_file, _ in file_pairs]
+
+    try:
+        for local_file, remote_file in file_pairs:
+            print(f"Pushing file {local_file} to {remote_file}")
+            try:
+                sftp.put(local_file, remote_file)
+            except Exception as e:
+                logger.log(f"FAILED PUSHING {local_file} TO {remote_file}: {e}")
+                failures.append((local_file, e))
+                continue
+            if on_success:
+                on_success(local_file, remote_file)
+    finally:
+        sftp.close()
+        transport.close()
+    return failures
@@ -1,27 +1,125 @@
 import requests
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
 from typing import Optional
 
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:  # optional - the standard library decoder is used without it
+    orjson = None
+
+# fulfillment order statuses that can still have a fulfillment created against them
+FULFILLABLE_STATUSES = ("open", "in_progress")
+# shared semaphore capping requests in flight when several tenants run at once
+_api_limiter = None
+# connections kept open to the shop - match it to the number of threads sharing a client
+DEFAULT_POOL_SIZE = 10
+# only the order fields process_orders reads, the full order is several times larger
+ORDER_FIELDS = "id,line_items,shipping_address,shipping_lines"
+
+
+def set_api_limiter(limiter):
+    """
+    Cap concurrent Shopify requests with a semaphore shared between processes.
+
+    Args:
+        limiter: Anything usable as a context manager, e.g. a Manager().BoundedSemaphore.
+            None removes the cap.
+    """
+    global _api_limiter
+    _api_limiter = limiter
+
+
+def _api_slot():
+    return _api_limiter if _api_limiter is not None else nullcontext()
+
+
+def decode_json(response):
+    """Decode a response body with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+
+@dataclass(frozen=True, slots=True)
+class FulfillmentOrderLineItem:
+    id: int
+    line_item_id: int
+    quantity: int
+    fulfillable_quantity: int
+
+
+@dataclass(frozen=True, slots=True)
+class FulfillmentOrder:
+    id: int
+    order_id: int
+    status: str
+    assigned_location_id: Optional[int]
+    line_items: tuple
+
+    @property
+    def is_open(self) -> bool:
+        return self.status in FULFILLABLE_STATUSES
+
+    @classmethod
+    def from_json(cls, data: dict) -> "FulfillmentOrder":
+        """Build a FulfillmentOrder from an entry of the fulfillment_orders.json response."""
+        return cls(
+            id=data["id"],
+            order_id=data.get("order_id"),
+            status=data["status"],
+            assigned_location_id=data.get("assigned_location_id"),
+            line_items=tuple(
+                FulfillmentOrderLineItem(
+                    id=item["id"],
+                    line_item_id=item.get("line_item_id"),
+                    quantity=item.get("quantity", 0),
+                    fulfillable_quantity=item.get("fulfillable_quantity", 0),
+                )
+                for item in data.get("line_items", [])
+            ),
+        )
+
 
 class ShopifyClient:
-    def __init__(self, shop_name: str, access_token: str):
+    def __init__(
+        self, shop_name: str, access_token: str, pool_size: int = DEFAULT_POOL_SIZE
+    ):
         """
         Initialize the ShopifyClient.
 
         Args:
             shop_name (str): The shop name you wish to make api calls to
             access-token (str): The shopify access token to authenticate
+            pool_size (int): Connections kept open to the shop. Threads beyond
+                that wait for a free connection instead of opening throwaway ones.
         """
         self.shop_name = shop_name
         self.access_token = access_token
         self.base_url = self._create_url()
         self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, pool_block=True
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self._set_header()
+        # seconds to wait before the next GraphQL call, worked out from the last throttle status
+        self._graphql_wait = 0.0
 
     def _set_header(self):
-        self.session.headers = {
-            "X-Shopify-Access-Token": self.access_token,
-            "Content-Type": "application/json",
-        }
+        # update rather than replace so the session keeps asking for gzip responses
+        self.session.headers.update(
+            {
+                "X-Shopify-Access-Token": self.access_token,
+                "Content-Type": "application/json",
+                "Accept": "application/json",
+                "Accept-Encoding": "gzip, deflate",
+            }
+        )
 
     def _create_url(
         self,
@@ -48,10 +146,11 @@ class ShopifyClient:
         Raises:
             requests.HTTPError: If the request is not successful.
         """
-        if json_data:
-            response = self.session.post(f"{self.base_url}{uri}", json=json_data)
-        else:
-            response = self.session.post(f"{self.base_url}{uri}")
+        with _api_slot():
+            if json_data:
+                response = self.session.post(f"{self.base_url}{uri}", json=json_data)
+            else:
+                response = self.session.post(f"{self.base_url}{uri}")
         if response.ok:
             return response
         return response.raise_for_status()
@@ -70,10 +169,11 @@ class ShopifyClient:
         Raises:
             requests.HTTPError: If the request is not successful.
         """
-        if json_data:
-            response = self.session.put(f"{self.base_url}{uri}", json=json_data)
-        else:
-            response = self.session.put(f"{self.base_url}{uri}")
+        with _api_slot():
+            if json_data:
+                response = self.session.put(f"{self.base_url}{uri}", json=json_data)
+            else:
+                response = self.session.put(f"{self.base_url}{uri}")
         if response.ok:
             return response
         return response.raise_for_status()
@@ -91,17 +191,66 @@ class ShopifyClient:
         Raises:
             requests.HTTPError: If the request is not successful.
         """
-        response = self.session.get(f"{self.base_url}{uri}")
+        with _api_slot():
+            response = self.session.get(f"{self.base_url}{uri}")
         if response.ok:
             return response
         return response.raise_for_status()
 
-    def get_orders(self, status):
+    def graphql(self, query: str, variables: Optional[dict] = None, retries: int = 5):
+        """
+        Run a GraphQL Admin API query, staying inside the cost based rate limit.
+
+        Shopify reports how much of the query budget is left with every response,
+        so the next call waits until enough has been restored to cover the cost of
+        this one. A THROTTLED error is retried after waiting.
+
+        Args:
+            query (str): The GraphQL query or mutation.
+            variables (Optional[dict]): Variables for the query.
+            retries (int): How many times a throttled call is retried.
+
+        Returns:
+            dict: The "data" part of the response.
+
+        Raises:
+            Exception: If the response contains errors other than throttling.
+        """
+        for attempt in range(retries + 1):
+            if self._graphql_wait > 0:
+                time.sleep(self._graphql_wait)
+                self._graphql_wait = 0.0
+            response = self._post(
+                "/admin/api/2024-04/graphql.json",
+                json_data={"query": query, "variables": variables or {}},
+            )
+            payload = decode_json(response)
+            cost = payload.get("extensions", {}).get("cost", {})
+            throttle = cost.get("throttleStatus", {})
+            restore_rate = float(throttle.get("restoreRate") or 50)
+            available = float(throttle.get("currentlyAvailable", 0))
+            requested = float(cost.get("requestedQueryCost", 0))
+            if requested > available:
+                self._graphql_wait = (requested - available) / restore_rate
+
+            errors = payload.get("errors")
+            if not errors:
+                return payload["data"]
+            throttled = any(
+                error.get("extensions", {}).get("code") == "THROTTLED"
+                for error in errors
+            )
+            if not throttled or attempt == retries:
+                raise Exception(f"GraphQL request failed: {errors}")
+            self._graphql_wait = max(self._graphql_wait, 1.0)
+
+    def get_orders(self, status, fields: str = ORDER_FIELDS):
         """
         Retrieve orders based on their status.
 
         Args:
         status (str): The status of the orders to retrieve.
+        fields (str): Comma separated order fields to return, None for all of them.
 
         Returns:
         list: A list of orders if any are found, None otherwise.
@@ -109,11 +258,14 @@ class ShopifyClient:
         Exception: If the HTTP request failed or if an unexpected error occurs.
         """
         try:
-            response = self._get(f"/admin/api/2024-04/orders.json?status={status}")
+            uri = f"/admin/api/2024-04/orders.json?status={status}"
+            if fields:
+                uri += f"&fields={fields}"
+            response = self._get(uri)
             response.raise_for_status()  # This will raise an HTTPError if the HTTP request returned an unsuccessful status code.
 
             if "application/json" in response.headers.get("Content-Type", ""):
-                data = response.json()
+                data = decode_json(response)
                 if data and "orders" in data:
                     return data["orders"]
                 return None
@@ -134,7 +286,7 @@ class ShopifyClient:
             raise
 
     def get_unshipped_orders(self):
-        orders = self.get_orders("open")
+        orders = self.get_orders("open", fields="id")
         order_list = []
         for order in orders:
             order_list.append(order["id"])
@@ -143,22 +295,32 @@ class ShopifyClient:
     def get_product(self, product_id):
         response = self._get(f"/admin/api/2024-04/products/{product_id}.json")
         if response.status_code.ok:
-            return response.json()
+            return decode_json(response)
         else:
             return response.raise_for_status()
 
     def get_product_metafields(self, product_id):
         response = self._get(
-            f"/admin/api/2024-04/products/{product_id}/metafields.json"
+            f"/admin/api/2024-04/products/{product_id}/metafields.json?fields=key,value"
         )
         if response.status_code == 200:
-            return response.json()[
+            return decode_json(response)[
                 "metafields"
             ]  # Returns a list of metafields for the product
         else:
             print(f"Failed to fetch metafields for product {product_id}")
             return None
 
+    def get_variant_barcode(self, variant_id):
+        response = self._get(
+            f"/admin/api/2024-04/variants/{variant_id}.json?fields=barcode"
+        )
+        if response.status_code == 200:
+            return decode_json(response)["variant"].get("barcode")
+        else:
+            print(f"Failed to fetch barcode for variant {variant_id}")
+            return None
+
     def update_fulfillment_shipping(self, fulfillment_id, tracking_number):
         shipping_payload = {
             "fulfillment": {
@@ -174,7 +336,7 @@ class ShopifyClient:
             print(
                 f"Tracking number {str(tracking_number)} updated for fulfillemnt {fulfillment_id}"
             )
-            return response.json()
+            return decode_json(response)
         else:
             return response.raise_for_status()
 
@@ -185,92 +347,93 @@ class ShopifyClient:
         else:
             return response.raise_for_status()
 
-    def _check_fulfillment_status(self, fulfillment_order_id):
-        response = self._get(
-            f"/admin/api/2024-04/fulfillment_orders/{fulfillment_order_id}.json"
-        )
-        if response.ok:
-            if response.json()["fulfillment_order"]["status"] == "closed":
-                return False
-            else:
-                return True
-        else:
-            response.raise_for_status()
-
-    def create_fulfillment(self, fulfillment_order_id_list) -> dict:
+    def create_fulfillment(self, fulfillment_orders) -> list:
         """
-        Create a fulfillment for an order.
+        Create fulfillments for every open fulfillment order of an order.
+
+        Fulfillment orders assigned to the same location are fulfilled together
+        in a single request, closed ones are skipped.
 
         Args:
-            order_id (str): The ID of the order to fulfill.
-            location_id (int): The ID of the location from which the items will be fulfilled.
-            line_items (list): A list of line item dictionaries to be fulfilled.
-            notify_customer (bool, optional): Whether to notify the customer via email. Defaults to False.
+            fulfillment_orders (list[FulfillmentOrder]): The fulfillment orders of the order,
+                as returned by get_fulfillment_orders.
 
         Returns:
-            dict: The JSON response from the Shopify API.
+            list: The JSON responses from the Shopify API, one per location.
         """
-        # check to make sure the fulfillment is open and not closed
-        for fulfillment_order_id in fulfillment_order_id_list:
-            fulfillment_status = self._check_fulfillment_status(fulfillment_order_id)
-            if fulfillment_status:
-                fulfillment_payload = {
-                    "fulfillment": {
-                        "message": "Thank you for your order! Your order was received and we are currently processing it.",
-                        "notify_customer": True,
-                        "line_items_by_fulfillment_order": [
-                            {"fulfillment_order_id": fulfillment_order_id}
-                        ],
-                    }
-                }
-                response = self._post(
-                    f"/admin/api/2024-04/fulfillments.json",
-                    json_data=fulfillment_payload,
-                )
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    return response.raise_for_status()
+        by_location = {}
+        for fulfillment_order in fulfillment_orders:
+            if fulfillment_order.is_open:
+                by_location.setdefault(
+                    fulfillment_order.assigned_location_id, []
+                ).append(fulfillment_order.id)
             else:
                 print(
-                    f"Fulfillment Order {fulfillment_order_id} marked as closed - no need to create fulfillment"
+                    f"Fulfillment Order {fulfillment_order.id} marked as {fulfillment_order.status} - no need to create fulfillment"
                 )
 
-    def get_fulfillment_order_id(self, order_id):
+        responses = []
+        for fulfillment_order_ids in by_location.values():
+            fulfillment_payload = {
+                "fulfillment": {
+                    "message": "Thank you for your order! Your order was received and we are currently processing it.",
+                    "notify_customer": True,
+                    "line_items_by_fulfillment_order": [
+                        {"fulfillment_order_id": fulfillment_order_id}
+                        for fulfillment_order_id in fulfillment_order_ids
+                    ],
+                }
+            }
+            response = self._post(
+                f"/admin/api/2024-04/fulfillments.json",
+                json_data=fulfillment_payload,
+            )
+            responses.append(decode_json(response))
+        return responses
+
+    def get_fulfillment_orders(self, order_id) -> list:
+        """
+        Fetch the fulfillment orders of an order, with their status and line items.
+
+        Returns:
+            list[FulfillmentOrder]: The fulfillment orders of the order.
+        """
         response = self._get(
             f"/admin/api/2024-04/orders/{order_id}/fulfillment_orders.json"
         )
-        fulfillment_orders = []
-        if response.ok:
-            for item in response.json()["fulfillment_orders"]:
-                fulfillment_orders.append(item["id"])
-            return fulfillment_orders
-        else:
-            return response.raise_for_status()
+        return [
+            FulfillmentOrder.from_json(item)
+            for item in decode_json(response)["fulfillment_orders"]
+        ]
+
+    def get_fulfillment_order_id(self, order_id):
+        return [
+            fulfillment_order.id
+            for fulfillment_order in self.get_fulfillment_orders(order_id)
+        ]
 
-    def get_fulfillments_by_fulfillment_order_id(self, fulfillment_order_id_list):
+    def get_fulfillments_by_fulfillment_order_id(self, fulfillment_orders):
         fulfillment_list = []
-        for item in fulfillment_order_id_list:
-            if self._check_fulfillment_status(item):
-                response = self._get(
-                    f"/admin/api/2024-04/fulfillment_orders/{item}/fulfillments.json"
-                )
-                if response.ok:
-                    for fulfillment in response.json()["fulfillments"]:
-                        fulfillment_list.append(fulfillment["id"])
-                    return fulfillment_list
-                else:
-                    return response.raise_for_status()
-            else:
+        for fulfillment_order in fulfillment_orders:
+            if fulfillment_order.status == "closed":
                 print(
-                    f"fulfillment order id {item} is marked as closed - nothing to pull"
+                    f"fulfillment order id {fulfillment_order.id} is marked as closed - nothing to pull"
                 )
+                continue
+            response = self._get(
+                f"/admin/api/2024-04/fulfillment_orders/{fulfillment_order.id}/fulfillments.json"
+            )
+            for fulfillment in decode_json(response)["fulfillments"]:
+                fulfillment_list.append(fulfillment["id"])
+        return fulfillment_list
 
     def get_fulfillments_by_order_id(self, order_id):
         fulfillment_list = []
-        response = self._get(f"/admin/api/2024-04/orders/{order_id}/fulfillments.json")
+        response = self._get(
+            f"/admin/api/2024-04/orders/{order_id}/fulfillments.json?fields=id,status"
+        )
         if response.ok:
-            for fulfillment in response.json()["fulfillments"]:
+            for fulfillment in decode_json(response)["fulfillments"]:
                 if fulfillment["status"] == "success":
                     fulfillment_list.append(fulfillment["id"])
             return fulfillment_list
@@ -279,10 +442,12 @@ class ShopifyClient:
 
     def get_variant_cost(self, item_id, item_sku):
         # we need to get the iventory ID from the product ID
-        product_reponse = self._get(f"/admin/api/2024-04/products/{item_id}.json")
+        product_reponse = self._get(
+            f"/admin/api/2024-04/products/{item_id}.json?fields=variants"
+        )
         if not product_reponse.ok:
             return product_reponse.raise_for_status()
-        for item in product_reponse.json()["product"]["variants"]:
+        for item in decode_json(product_reponse)["product"]["variants"]:
             if item["sku"] == item_sku:
                 inventory_id = item["inventory_item_id"]
                 break
@@ -290,20 +455,24 @@ class ShopifyClient:
             f"/admin/api/2024-04/inventory_items/{inventory_id}.json"
         )
         if inventory_response.ok:
-            return inventory_response.json()["inventory_item"]["cost"]
+            return decode_json(inventory_response)["inventory_item"]["cost"]
         else:
             return inventory_response.raise_for_status()
 
     def get_order_risk(self, order_id):
         response = self._get(f"/admin/api/2024-04/orders/{order_id}/risks.json")
         if response.ok:
-            return response.json()
+            return decode_json(response)
         else:
             return response.raise_for_status()
 
     def get_order_risk_number(self, order_id):
+        """The fraud score of an order, None while Shopify hasn't assessed it yet."""
         response = self._get(f"/admin/api/2024-04/orders/{order_id}/risks.json")
         if response.ok:
-            return float(response.json()["risks"][0]["score"])
+            risks = decode_json(response)["risks"]
+            if not risks:
+                return None
+            return float(risks[0]["score"])
         else:
             return response.raise_for_status()
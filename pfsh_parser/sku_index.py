@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import pandas as pd
+
+from pfsh_parser.catalog_schema import (
+    CATALOG_DTYPES,
+    apply_catalog_schema,
+    price_to_decimal,
+)
+
+SKU_INDEX_FILE = "files/tmp/sku_index.json"
+ITEM_NUMBER_COLUMN = "Metafield: custom.item_number [single_line_text_field]"
+
+
+@dataclass(frozen=True, slots=True)
+class SkuEntry:
+    item_number: Optional[str]
+    cost: Optional[float]
+
+
+def file_fingerprint(path: str) -> str:
+    """sha256 of a file, used to tell whether the catalog changed since the index was built."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SkuIndex:
+    def __init__(self, by_sku: dict, by_barcode: dict, source: str = ""):
+        """
+        In-memory SKU/barcode lookup of Sheralven item numbers and costs.
+
+        The master catalog is built from the supplier feed and carries no
+        Shopify product or variant IDs, so those are not part of an entry -
+        order line items bring their own.
+
+        Args:
+            by_sku (dict): Maps a SKU (SHERALVEN UPC) to a SkuEntry.
+            by_barcode (dict): Maps a barcode (MFG UPC) to its SKU.
+            source (str): Fingerprint of the catalog the index was built from.
+        """
+        self.by_sku = by_sku
+        self.by_barcode = by_barcode
+        self.source = source
+
+    def __len__(self):
+        return len(self.by_sku)
+
+    def lookup(self, sku=None, barcode=None) -> Optional[SkuEntry]:
+        if sku:
+            entry = self.by_sku.get(str(sku).strip())
+            if entry is not None:
+                return entry
+        if barcode:
+            sku = self.by_barcode.get(str(barcode).strip())
+            if sku is not None:
+                return self.by_sku.get(sku)
+        return None
+
+    @classmethod
+    def from_catalog(cls, catalog_df: pd.DataFrame, source: str = "") -> "SkuIndex":
+        """Build the index from a catalog frame using the Matrixify column names."""
+        catalog_df = apply_catalog_schema(catalog_df)
+
+        def column(name):
+            if name in catalog_df.columns:
+                return catalog_df[name].tolist()
+            return [None] * len(catalog_df)
+
+        by_sku = {}
+        by_barcode = {}
+        for sku, barcode, item_number, cost in zip(
+            column("Variant SKU [ID]"),
+            column("Variant Barcode"),
+            column(ITEM_NUMBER_COLUMN),
+            column("Variant Cost"),
+        ):
+            if pd.isna(sku):
+                continue
+            sku = str(sku)
+            by_sku[sku] = SkuEntry(
+                item_number=None if pd.isna(item_number) else str(item_number),
+                cost=None if pd.isna(cost) else float(price_to_decimal(cost)),
+            )
+            if not pd.isna(barcode):
+                by_barcode[str(barcode)] = sku
+        return cls(by_sku, by_barcode, source)
+
+    def save(self, path: str = SKU_INDEX_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = {
+            "source": self.source,
+            "by_sku": {
+                sku: [entry.item_number, entry.cost]
+                for sku, entry in self.by_sku.items()
+            },
+            "by_barcode": self.by_barcode,
+        }
+        # write then rename so a reader never sees a half written index
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(payload, file)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = SKU_INDEX_FILE) -> "SkuIndex":
+        with open(path) as file:
+            payload = json.load(file)
+        by_sku = {sku: SkuEntry(*values) for sku, values in payload["by_sku"].items()}
+        return cls(by_sku, payload["by_barcode"], payload.get("source", ""))
+
+
+def read_catalog_file(catalog_file: str) -> pd.DataFrame:
+    """Read the master catalog with the key columns kept as text."""
+    text_columns = {
+        column: str for column, dtype in CATALOG_DTYPES.items() if dtype == "string"
+    }
+    return pd.read_excel(catalog_file, engine="openpyxl", dtype=text_columns)
+
+
+def load_sku_index(catalog_file: str, index_path: str = SKU_INDEX_FILE) -> SkuIndex:
+    """
+    Load the SKU index for a catalog, rebuilding it first if the catalog changed.
+
+    Args:
+        catalog_file (str): The master catalog xlsx the index is built from.
+        index_path (str): Where the index is kept on disk.
+
+    Returns:
+        SkuIndex: The index, ready for lookups.
+    """
+    source = file_fingerprint(catalog_file)
+    if os.path.exists(index_path):
+        try:
+            index = SkuIndex.load(index_path)
+            if index.source == source:
+                return index
+        except (ValueError, KeyError, TypeError):
+            pass  # unreadable or older format index - rebuild it below
+    index = SkuIndex.from_catalog(read_catalog_file(catalog_file), source)
+    index.save(index_path)
+    return index
@@ -1,8 +1,23 @@
+import atexit
+import os
+import queue
 import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
+from functools import lru_cache
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
 
+@lru_cache(maxsize=None)
+def _template_env(template_dir: str) -> Environment:
+    # one environment per folder so compiled templates are reused across senders
+    return Environment(
+        loader=FileSystemLoader(template_dir),
+        autoescape=select_autoescape(["html", "xml"]),
+    )
+
+
 class EmailSender:
     def __init__(
         self,
@@ -11,24 +26,25 @@ class EmailSender:
         username: str,
         password: str,
         template_dir: str = "templates",
+        allow_insecure_login: bool = False,
     ):
         """
         Initialize the EmailSender with SMTP settings and template directory.
 
         :param smtp_server: SMTP server address (e.g., smtp.office365.com).
         :param smtp_port: SMTP server port (e.g., 587).
-        :param username: SMTP username/email address.
+        :param username: SMTP username/email address. Leave empty to skip login.
         :param password: SMTP password or app password.
         :param template_dir: Directory where Jinja templates are stored.
+        :param allow_insecure_login: Log in even when the server does not offer
+            STARTTLS. Only for a local test server - it sends the password in plaintext.
         """
         self.smtp_server = smtp_server
         self.smtp_port = smtp_port
         self.username = username
         self.password = password
-        self.env = Environment(
-            loader=FileSystemLoader(template_dir),
-            autoescape=select_autoescape(["html", "xml"]),
-        )
+        self.allow_insecure_login = allow_insecure_login
+        self.env = _template_env(os.path.abspath(template_dir))
 
     def render_template(self, template_name: str, context: dict) -> str:
         """
@@ -41,6 +57,44 @@ class EmailSender:
         template = self.env.get_template(template_name)
         return template.render(context)
 
+    def build_message(
+        self, subject: str, sender: str, recipients: list, body: str, html: bool = False
+    ) -> MIMEText:
+        # Choose MIME subtype
+        mime_subtype = "html" if html else "plain"
+        msg = MIMEText(body, mime_subtype)
+        msg["Subject"] = subject
+        msg["From"] = sender
+        msg["To"] = ", ".join(recipients)
+        return msg
+
+    def connect(self) -> smtplib.SMTP:
+        """
+        Open an SMTP connection, upgraded with STARTTLS and logged in when a
+        username is set. Without a username STARTTLS is still used when offered.
+
+        :return: The connected smtplib.SMTP client.
+        :raises smtplib.SMTPNotSupportedError: If credentials are set and the
+            server does not offer STARTTLS.
+        """
+        server = smtplib.SMTP(self.smtp_server, int(self.smtp_port), timeout=30)
+        try:
+            server.ehlo()
+            if server.has_extn("starttls"):
+                server.starttls()
+                server.ehlo()
+            elif self.username and not self.allow_insecure_login:
+                # never send the password unencrypted, e.g. when STARTTLS was stripped on the way
+                raise smtplib.SMTPNotSupportedError(
+                    f"{self.smtp_server} does not offer STARTTLS - refusing to log in unencrypted"
+                )
+            if self.username:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
     def send_email(
         self, subject: str, sender: str, recipients: list, body: str, html: bool = False
     ) -> None:
@@ -53,19 +107,9 @@ class EmailSender:
         :param body: The email content.
         :param html: Whether the email content is HTML. Defaults to False.
         """
-        # Choose MIME subtype
-        mime_subtype = "html" if html else "plain"
-        msg = MIMEText(body, mime_subtype)
-        msg["Subject"] = subject
-        msg["From"] = sender
-        msg["To"] = ", ".join(recipients)
-
+        msg = self.build_message(subject, sender, recipients, body, html)
         try:
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.ehlo()
-                server.starttls()
-                server.ehlo()
-                server.login(self.username, self.password)
+            with self.connect() as server:
                 server.sendmail(sender, recipients, msg.as_string())
             print(f"Email sent successfully to the following recipients {recipients}")
         except Exception as e:
@@ -90,3 +134,219 @@ class EmailSender:
         """
         body = self.render_template(template_name, context)
         self.send_email(subject, sender, recipients, body, html=True)
+
+
+# queue items the worker thread handles besides messages
+_FLUSH = "flush"
+_STOP = "stop"
+
+
+class MailQueue:
+    def __init__(
+        self,
+        email_sender: EmailSender,
+        digest_window: float = 300,
+        idle_timeout: float = 30,
+    ):
+        """
+        Send mail from a background thread over one reused SMTP connection.
+
+        Callers only put messages on a queue, so they never wait on the mail
+        server. Items added to a digest within digest_window seconds of the first
+        one go out together as a single templated email. The connection is
+        dropped after idle_timeout seconds without mail and opened again when
+        needed. Pending mail is sent when close is called or the process exits.
+
+        :param email_sender: Supplies the SMTP settings and the templates.
+        :param digest_window: Seconds a digest collects items before it is sent.
+        :param idle_timeout: Seconds an unused connection is kept open.
+        """
+        self.email_sender = email_sender
+        self.digest_window = digest_window
+        self.idle_timeout = idle_timeout
+        self.sent = 0
+        self.failed = 0
+        self._queue = queue.Queue()
+        # digest key -> [deadline, subject, sender, recipients, template_name, items_key, items]
+        self._digests = {}
+        self._server = None
+        self._last_used = 0.0
+        self._thread = threading.Thread(
+            target=self._run, name="mail-queue", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def send(
+        self, subject: str, sender: str, recipients: list, body: str, html: bool = False
+    ):
+        """Queue an email, returns straight away."""
+        self._queue.put(("message", (subject, sender, recipients, body, html)))
+
+    def send_template(
+        self,
+        subject: str,
+        sender: str,
+        recipients: list,
+        template_name: str,
+        context: dict,
+    ):
+        """Queue a templated email, it is rendered on the mail thread."""
+        self._queue.put(
+            ("template", (subject, sender, recipients, template_name, context))
+        )
+
+    def add_to_digest(
+        self,
+        subject: str,
+        sender: str,
+        recipients: list,
+        template_name: str,
+        items: list,
+        items_key: str = "items",
+    ):
+        """
+        Add items to the digest sent with this subject and template.
+
+        The template is rendered with every item collected during the window
+        under items_key.
+        """
+        if items:
+            self._queue.put(
+                (
+                    "digest",
+                    (
+                        subject,
+                        sender,
+                        tuple(recipients),
+                        template_name,
+                        items_key,
+                        list(items),
+                    ),
+                )
+            )
+
+    def flush(self, timeout: float = None) -> bool:
+        """Send queued mail and open digests now, waiting until that is done."""
+        if not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 60):
+        """Flush everything and stop the mail thread."""
+        if self._thread.is_alive():
+            self._queue.put((_STOP, None))
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                kind, payload = self._queue.get(timeout=self._wait_time())
+            except queue.Empty:
+                kind, payload = None, None
+
+            if kind == "message":
+                self._deliver(*payload)
+            elif kind == "template":
+                subject, sender, recipients, template_name, context = payload
+                self._deliver_template(
+                    subject, sender, recipients, template_name, context
+                )
+            elif kind == "digest":
+                self._collect(*payload)
+            elif kind in (_FLUSH, _STOP):
+                self._send_digests(force=True)
+                if kind == _STOP:
+                    self._disconnect()
+                    return
+                payload.set()
+
+            self._send_digests()
+            if (
+                self._server is not None
+                and time.monotonic() - self._last_used > self.idle_timeout
+            ):
+                self._disconnect()
+
+    def _wait_time(self) -> float:
+        wait = self.idle_timeout
+        if self._digests:
+            next_deadline = min(digest[0] for digest in self._digests.values())
+            wait = min(wait, next_deadline - time.monotonic())
+        return max(wait, 0.01)
+
+    def _collect(self, subject, sender, recipients, template_name, items_key, items):
+        key = (subject, sender, recipients, template_name, items_key)
+        if key not in self._digests:
+            deadline = time.monotonic() + self.digest_window
+            self._digests[key] = [
+                deadline,
+                subject,
+                sender,
+                list(recipients),
+                template_name,
+                items_key,
+                [],
+            ]
+        self._digests[key][6].extend(items)
+
+    def _send_digests(self, force: bool = False):
+        now = time.monotonic()
+        for key, digest in list(self._digests.items()):
+            (
+                deadline,
+                subject,
+                sender,
+                recipients,
+                template_name,
+                items_key,
+                items,
+            ) = digest
+            if force or deadline <= now:
+                del self._digests[key]
+                self._deliver_template(
+                    subject, sender, recipients, template_name, {items_key: items}
+                )
+
+    def _deliver_template(self, subject, sender, recipients, template_name, context):
+        try:
+            body = self.email_sender.render_template(template_name, context)
+        except Exception as e:
+            self.failed += 1
+            print(f"Failed to render email template {template_name}: {e}")
+            return
+        self._deliver(subject, sender, recipients, body, True)
+
+    def _deliver(self, subject, sender, recipients, body, html):
+        msg = self.email_sender.build_message(subject, sender, recipients, body, html)
+        # a reused connection may have been dropped by the server - reconnect once
+        for attempt in range(2):
+            try:
+                if self._server is None:
+                    self._server = self.email_sender.connect()
+                self._server.sendmail(sender, recipients, msg.as_string())
+                self._last_used = time.monotonic()
+                self.sent += 1
+                print(
+                    f"Email sent successfully to the following recipients {recipients}"
+                )
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError) as e:
+                self._disconnect()
+                error = e
+            except Exception as e:
+                error = e
+                break
+        self.failed += 1
+        print(f"Failed to send email: {error}")
+
+    def _disconnect(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            self._server.close()
+        self._server = None
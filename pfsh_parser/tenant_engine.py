@@ -0,0 +1,251 @@
+import json
+import multiprocessing
+import os
+import re
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field, fields
+from datetime import datetime
+from typing import Optional
+
+# tenants get their own working folder so files, caches and logs never mix
+TENANTS_DIR = "files/tenants"
+RUN_REPORT_FILE = "run_report.json"
+_ENV_REFERENCE = re.compile(r"\$\{([A-Za-z0-9_]+)\}")
+
+
+@dataclass(frozen=True)
+class TenantConfig:
+    """Everything one storefront + supplier feed pipeline needs to run."""
+
+    name: str
+    shop_name: str
+    access_token: str
+    sftp_host: str
+    sftp_username: str
+    sftp_password: str
+    sftp_port: int = 22
+    base_inventory_file: str = ""
+    master_inventory_file: str = ""
+    updated_inventory_file: str = ""
+    base_orders_file: str = ""
+    updated_orders_file: str = "adjusted_orders_file.csv"
+    shipping_file: str = ""
+    email_server: str = ""
+    email_port: int = 587
+    email_sender: str = ""
+    email_password: str = ""
+    recipient_list: str = ""
+    inventory_export_mode: str = "single"
+    inventory_shard_rows: int = 5000
+    inventory_shard_by: Optional[str] = None
+    shopify_location_id: Optional[str] = None
+    inventory_sync_dry_run: bool = False
+    # working folder of the tenant - relative paths like files/tmp resolve inside it
+    work_dir: str = "."
+    log_file: str = "files/log.txt"
+    extra_env: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_env(cls) -> "TenantConfig":
+        """The single tenant described by the environment variables in creds.py."""
+        from pfsh_parser import creds
+
+        return cls(
+            name=creds.SHOP_NAME,
+            shop_name=creds.SHOP_NAME,
+            access_token=creds.SHOPIFY_ACCESS_TOKEN,
+            sftp_host=creds.HOST,
+            sftp_username=creds.PFSH_USERNAME,
+            sftp_password=creds.PFSH_PASSWORD,
+            base_inventory_file=creds.BASE_INVENTORY_FILE,
+            master_inventory_file=creds.MASTER_INVENTORY_FILE,
+            updated_inventory_file=creds.UPDATED_INVENTORY_FILE,
+            base_orders_file=creds.BASE_ORDERS_FILE,
+            updated_orders_file=creds.UPDATED_ORDERS_FILE,
+            shipping_file=creds.SHIPPING_FILE,
+            email_server=creds.EMAIL_SERVER,
+            email_port=int(creds.EMAIL_PORT),
+            email_sender=creds.EMAIL_SENDER,
+            email_password=creds.EMAIL_PASSWORD,
+            recipient_list=creds.RECIPIENT_LIST,
+            inventory_export_mode=creds.INVENTORY_EXPORT_MODE,
+            inventory_shard_rows=creds.INVENTORY_SHARD_ROWS,
+            inventory_shard_by=creds.INVENTORY_SHARD_BY,
+            shopify_location_id=creds.SHOPIFY_LOCATION_ID,
+            inventory_sync_dry_run=creds.INVENTORY_SYNC_DRY_RUN,
+            log_file=creds.LOG_FILE,
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict, tenants_dir: str = TENANTS_DIR) -> "TenantConfig":
+        """
+        Build a tenant from an entry of the tenants file.
+
+        Values can reference environment variables as "${NAME}" so secrets stay
+        out of the file. work_dir defaults to files/tenants/<name> and log_file
+        to a log inside it.
+        """
+        known = {item.name for item in fields(cls)}
+        unknown = set(data) - known
+        if unknown:
+            raise Exception(f"UNKNOWN TENANT SETTINGS {sorted(unknown)}")
+        values = {key: _expand(value) for key, value in data.items()}
+        work_dir = os.path.abspath(
+            values.get("work_dir") or os.path.join(tenants_dir, values["name"])
+        )
+        values["work_dir"] = work_dir
+        values["log_file"] = os.path.join(
+            work_dir, values.get("log_file", "files/log.txt")
+        )
+        return cls(**values)
+
+    def path(self, *parts) -> str:
+        """A path inside the tenant's working folder, e.g. path("files", "tmp")."""
+        return os.path.join(self.work_dir, *parts)
+
+    def environment(self) -> dict:
+        """The creds.py environment variables for this tenant."""
+        env = {
+            "PFSH_USERNAME": self.sftp_username,
+            "PFSH_PASSWORD": self.sftp_password,
+            "HOST": self.sftp_host,
+            "BASE_INVENTORY_FILE": self.base_inventory_file,
+            "MASTER_INVENTORY_FILE": self.master_inventory_file,
+            "UPDATED_INVENTORY_FILE": self.updated_inventory_file,
+            "BASE_ORDERS_FILE": self.base_orders_file,
+            "UPDATED_ORDERS_FILE": self.updated_orders_file,
+            "LOG_FILE": self.log_file,
+            "SHOP_NAME": self.shop_name,
+            "SHOPIFY_ACCESS_TOKEN": self.access_token,
+            "SHIPPING_FILE": self.shipping_file,
+            "EMAIL_SENDER": self.email_sender,
+            "EMAIL_PASSWORD": self.email_password,
+            "RECIPIENT_LIST": self.recipient_list,
+            "EMAIL_SERVER": self.email_server,
+            "EMAIL_PORT": str(self.email_port),
+        }
+        env.update({key: str(value) for key, value in self.extra_env.items()})
+        return env
+
+
+def _expand(value):
+    if isinstance(value, str):
+        return _ENV_REFERENCE.sub(
+            lambda match: os.environ.get(match.group(1), ""), value
+        )
+    return value
+
+
+def load_tenants(tenants_file: str) -> list:
+    """Read the tenants JSON file - a list of TenantConfig settings."""
+    with open(tenants_file) as file:
+        data = json.load(file)
+    tenants = [TenantConfig.from_dict(entry) for entry in data]
+    names = [tenant.name for tenant in tenants]
+    if len(set(names)) != len(names):
+        raise Exception("TENANT NAMES MUST BE UNIQUE")
+    return tenants
+
+
+@dataclass
+class TenantResult:
+    tenant: str
+    pipeline: str
+    status: str
+    started: str
+    duration: float
+    details: dict = field(default_factory=dict)
+    error: str = ""
+
+
+def _run_tenant(tenant: TenantConfig, pipeline: str, api_slots) -> TenantResult:
+    """Run one tenant's pipeline inside a fresh worker process."""
+    started = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    clock = time.perf_counter()
+    # the pipelines hand the engines this tenant's settings and paths directly - the
+    # environment is still applied because creds.py requires it on import, and the
+    # working folder keeps the profiling reports apart
+    os.environ.update(tenant.environment())
+    os.makedirs(os.path.join(tenant.work_dir, "files", "tmp"), exist_ok=True)
+    os.chdir(tenant.work_dir)
+    try:
+        from pfsh_parser import pipelines, shopify_engine
+
+        shopify_engine.set_api_limiter(api_slots)
+        details = pipelines.PIPELINES[pipeline](tenant) or {}
+        status, error = "ok", ""
+    except Exception:
+        details, status, error = {}, "failed", traceback.format_exc()
+    return TenantResult(
+        tenant=tenant.name,
+        pipeline=pipeline,
+        status=status,
+        started=started,
+        duration=round(time.perf_counter() - clock, 2),
+        details=details,
+        error=error,
+    )
+
+
+def run_tenants(
+    tenants: list,
+    pipeline: str,
+    max_workers: int = 4,
+    api_concurrency: int = 4,
+    report_dir: str = TENANTS_DIR,
+) -> dict:
+    """
+    Run a pipeline for every tenant concurrently in a process pool.
+
+    Every tenant runs in its own freshly spawned process with its own working
+    folder and log, while a shared semaphore caps how many Shopify API calls
+    are in flight across all of them.
+
+    Args:
+        tenants (list[TenantConfig]): The tenants to run.
+        pipeline (str): "inventory", "orders" or "shipping".
+        max_workers (int): Number of tenants processed at the same time.
+        api_concurrency (int): Maximum Shopify requests in flight across all tenants.
+        report_dir (str): Where the aggregated run report is written.
+
+    Returns:
+        dict: The aggregated run report.
+    """
+    context = multiprocessing.get_context("spawn")
+    started = time.perf_counter()
+    with context.Manager() as manager:
+        api_slots = manager.BoundedSemaphore(api_concurrency)
+        with ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=context, max_tasks_per_child=1
+        ) as executor:
+            futures = [
+                executor.submit(_run_tenant, tenant, pipeline, api_slots)
+                for tenant in tenants
+            ]
+            results = []
+            for tenant, future in zip(tenants, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    # the worker itself died, e.g. killed for running out of memory
+                    results.append(
+                        TenantResult(
+                            tenant.name, pipeline, "failed", "", 0.0, error=repr(e)
+                        )
+                    )
+
+    report = {
+        "pipeline": pipeline,
+        "finished": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "duration": round(time.perf_counter() - started, 2),
+        "tenants": len(results),
+        "succeeded": sum(1 for result in results if result.status == "ok"),
+        "failed": sum(1 for result in results if result.status != "ok"),
+        "results": [asdict(result) for result in results],
+    }
+    os.makedirs(report_dir, exist_ok=True)
+    with open(os.path.join(report_dir, RUN_REPORT_FILE), "w") as file:
+        json.dump(report, file, indent=2)
+    return report
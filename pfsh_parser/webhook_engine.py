@@ -0,0 +1,430 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from pfsh_parser.creds import LOG_FILE
+from pfsh_parser.log_engine import LogEngine
+
+# Shopify topics that should trigger an order being sent to Sheralven
+ORDER_TOPICS = ("orders/create", "orders/paid")
+# largest webhook body read - order payloads are a few KiB, anything this big is not Shopify
+MAX_WEBHOOK_BODY = 1024 * 1024
+
+
+def sign_webhook(body: bytes, secret: str) -> str:
+    """
+    Compute the value Shopify puts in the X-Shopify-Hmac-Sha256 header.
+
+    Args:
+        body (bytes): The raw request body.
+        secret (str): The webhook signing secret of the app.
+
+    Returns:
+        str: The base64 encoded HMAC-SHA256 digest of the body.
+    """
+    digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("utf-8")
+
+
+def verify_webhook(body: bytes, hmac_header: str, secret: str) -> bool:
+    """
+    Check a webhook body against the HMAC header Shopify sent with it.
+
+    Args:
+        body (bytes): The raw request body, exactly as received.
+        hmac_header (str): The X-Shopify-Hmac-Sha256 header value.
+        secret (str): The webhook signing secret of the app.
+
+    Returns:
+        bool: True if the signature matches.
+    """
+    if not secret or not hmac_header:
+        return False
+    return hmac.compare_digest(sign_webhook(body, secret), hmac_header)
+
+
+def send_test_webhook(url, secret, order, topic="orders/create"):
+    """
+    Send a signed webhook to a running daemon, the same way Shopify would.
+
+    Handy for testing the daemon locally, e.g.
+        send_test_webhook("http://127.0.0.1:8080/webhooks/orders", secret, order)
+
+    Returns:
+        requests.Response: The response from the daemon.
+    """
+    body = json.dumps(order).encode("utf-8")
+    headers = {
+        "Content-Type": "application/json",
+        "X-Shopify-Topic": topic,
+        "X-Shopify-Hmac-Sha256": sign_webhook(body, secret),
+    }
+    return requests.post(url, data=body, headers=headers, timeout=10)
+
+
+class OrderQueue:
+    def __init__(
+        self,
+        db_path="files/state/order_queue.db",
+        max_attempts=5,
+        retry_delay=30,
+        requeue_after=3600,
+    ):
+        """
+        Durable queue of orders waiting to be sent to Sheralven.
+
+        Orders are keyed by their Shopify ID so the same order arriving from
+        several webhooks and the safety-net poll is only processed once.
+
+        Args:
+            db_path (str): Location of the sqlite database backing the queue.
+            max_attempts (int): How many times an order is retried before it is
+                parked as failed.
+            retry_delay (float): Seconds before the first retry of a failed order,
+                doubled for every further attempt.
+            requeue_after (float): Seconds after which a parked order can be
+                queued again by a webhook or the poll.
+        """
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.requeue_after = requeue_after
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS orders (
+                order_id INTEGER PRIMARY KEY,
+                payload TEXT NOT NULL,
+                source TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                received_at REAL NOT NULL,
+                processed_at REAL,
+                available_at REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(orders)")}
+        if "available_at" not in columns:
+            # queue created before retries were delayed
+            self.conn.execute(
+                "ALTER TABLE orders ADD COLUMN available_at REAL NOT NULL DEFAULT 0"
+            )
+
+    def enqueue(self, order: dict, source: str) -> bool:
+        """
+        Add an order to the queue. A pending order gets its payload refreshed,
+        an order that was already processed is left alone. An order parked as
+        failed is queued again with fresh attempts once requeue_after has passed.
+
+        Returns:
+            bool: True if the order was added or refreshed.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self.conn.execute(
+                """
+                INSERT INTO orders (order_id, payload, source, received_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(order_id) DO UPDATE SET
+                    payload = excluded.payload,
+                    source = excluded.source,
+                    attempts = CASE WHEN orders.status = 'failed' THEN 0 ELSE orders.attempts END,
+                    available_at = CASE
+                        WHEN orders.status = 'failed' THEN 0 ELSE orders.available_at
+                    END,
+                    status = 'pending'
+                WHERE orders.status = 'pending'
+                    OR (orders.status = 'failed' AND COALESCE(orders.processed_at, 0) <= ?)
+                """,
+                (
+                    int(order["id"]),
+                    json.dumps(order),
+                    source,
+                    now,
+                    now - self.requeue_after,
+                ),
+            )
+            return cursor.rowcount > 0
+
+    def next_batch(self, size: int) -> list:
+        """Return up to size pending orders that are due, oldest first."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT payload FROM orders WHERE status = 'pending' AND available_at <= ? "
+                "ORDER BY received_at LIMIT ?",
+                (time.time(), size),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def mark_done(self, order_ids):
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE orders SET status = 'done', processed_at = ? "
+                "WHERE order_id = ?",
+                [(time.time(), int(order_id)) for order_id in order_ids],
+            )
+
+    def mark_failed(self, order_ids):
+        """
+        Count a failed attempt. The order is retried after a growing delay and
+        parked as failed once it ran out of attempts.
+        """
+        now = time.time()
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE orders SET attempts = attempts + 1, processed_at = ?, "
+                "available_at = ? + ? * (1 << attempts), "
+                "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END "
+                "WHERE order_id = ?",
+                [
+                    (now, now, self.retry_delay, self.max_attempts, int(order_id))
+                    for order_id in order_ids
+                ],
+            )
+
+    def defer(self, order_ids, delay: float):
+        """Try orders again after delay seconds without counting an attempt."""
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE orders SET available_at = ? WHERE order_id = ?",
+                [(time.time() + delay, int(order_id)) for order_id in order_ids],
+            )
+
+    def pending_count(self) -> int:
+        """Pending orders that are due now."""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM orders WHERE status = 'pending' AND available_at <= ?",
+                (time.time(),),
+            ).fetchone()[0]
+
+    def seconds_until_due(self, default: float) -> float:
+        """Seconds until the next waiting order is due, at most default."""
+        with self._lock:
+            next_due = self.conn.execute(
+                "SELECT MIN(available_at) FROM orders WHERE status = 'pending'"
+            ).fetchone()[0]
+        if next_due is None:
+            return default
+        return min(default, max(next_due - time.time(), 0))
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != self.server.webhook_path:
+            self._respond(404)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            self._respond(400)
+            return
+        if length < 0:
+            self._respond(400)
+            return
+        if length > self.server.max_body_size:
+            # refuse before reading so an unauthenticated client can't make us buffer it
+            self.server.logger.log(f"WEBHOOK: REJECTED {length} BYTE BODY")
+            self.close_connection = True
+            self._respond(413)
+            return
+        body = self.rfile.read(length)
+        if not verify_webhook(
+            body, self.headers.get("X-Shopify-Hmac-Sha256"), self.server.secret
+        ):
+            self.server.logger.log("WEBHOOK: REJECTED REQUEST WITH BAD HMAC")
+            self._respond(401)
+            return
+        topic = self.headers.get("X-Shopify-Topic", "")
+        if topic not in ORDER_TOPICS:
+            # acknowledge so Shopify doesn't keep retrying topics we don't use
+            self._respond(200)
+            return
+        try:
+            order = json.loads(body)
+        except ValueError:
+            self._respond(400)
+            return
+        if not isinstance(order, dict) or "id" not in order:
+            self.server.logger.log(
+                f"WEBHOOK: REJECTED {topic} PAYLOAD WITHOUT AN ORDER ID"
+            )
+            self._respond(400)
+            return
+        try:
+            queued = self.server.queue.enqueue(order, topic)
+        except (TypeError, ValueError):
+            # an id that is not a number
+            self.server.logger.log(
+                f"WEBHOOK: REJECTED {topic} PAYLOAD WITH ORDER ID {order['id']!r}"
+            )
+            self._respond(400)
+            return
+        if queued:
+            self.server.logger.log(f"WEBHOOK: QUEUED ORDER {order['id']} ({topic})")
+            self.server.wakeup.set()
+        # Shopify only waits 5 seconds so respond before doing any real work
+        self._respond(200)
+
+    def _respond(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        # keep the default stderr access log quiet - everything we care about is logged above
+        pass
+
+
+class OrderDaemon:
+    def __init__(
+        self,
+        sh_client,
+        process_batch,
+        secret: str,
+        queue: OrderQueue,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        webhook_path: str = "/webhooks/orders",
+        batch_size: int = 10,
+        batch_window: float = 5,
+        poll_interval: float = 900,
+        max_body_size: int = MAX_WEBHOOK_BODY,
+        defer_delay: float = 60,
+    ):
+        """
+        Resident service that accepts order webhooks and processes them in micro-batches.
+
+        Args:
+            sh_client (ShopifyClient): Client used by the safety-net poll.
+            process_batch (callable): Called with a list of orders, does the actual work.
+                It returns None when every order went through, or an object with
+                lists of order IDs under failed and deferred (like the OrderRunReport
+                of process_orders) - failed orders are retried, deferred ones are
+                tried again later without counting an attempt. Orders not listed are
+                done. An exception fails the whole batch.
+            secret (str): Webhook signing secret used to verify incoming requests.
+            queue (OrderQueue): Durable queue orders are stored in until processed.
+            host (str): Interface to listen on.
+            port (int): Port to listen on.
+            webhook_path (str): Path Shopify posts webhooks to.
+            batch_size (int): Maximum number of orders per batch.
+            batch_window (float): Seconds to wait for more orders after the first one arrives.
+            poll_interval (float): Seconds between polls for open orders that a webhook missed.
+            max_body_size (int): Largest request body accepted, bigger ones get a 413.
+            defer_delay (float): Seconds before a deferred order is tried again.
+        """
+        self.sh_client = sh_client
+        self.process_batch = process_batch
+        self.queue = queue
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.poll_interval = poll_interval
+        self.defer_delay = defer_delay
+        self.logger = LogEngine(file_path=LOG_FILE)
+        self.wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._last_poll = None
+
+        self.server = ThreadingHTTPServer((host, port), WebhookHandler)
+        self.server.webhook_path = webhook_path
+        self.server.secret = secret
+        self.server.max_body_size = max_body_size
+        self.server.queue = queue
+        self.server.wakeup = self.wakeup
+        self.server.logger = self.logger
+
+    def poll(self):
+        """Queue every open order - anything already processed is ignored by the queue."""
+        self._last_poll = time.monotonic()
+        try:
+            orders = self.sh_client.get_orders("open") or []
+        except Exception as e:
+            self.logger.log(f"DAEMON: POLL FAILED - {e}")
+            return
+        queued = sum(1 for order in orders if self.queue.enqueue(order, "poll"))
+        if queued:
+            self.logger.log(f"DAEMON: POLL QUEUED {queued} ORDERS")
+
+    def run_batch(self) -> int:
+        """Process one micro-batch from the queue, returns the number of orders handled."""
+        batch = self.queue.next_batch(self.batch_size)
+        if not batch:
+            return 0
+        order_ids = [order["id"] for order in batch]
+        # closed or cancelled orders can still be sent by a late orders/paid webhook
+        orders = [
+            order
+            for order in batch
+            if not order.get("closed_at") and not order.get("cancelled_at")
+        ]
+        self.logger.log(f"DAEMON: PROCESSING {len(orders)} ORDERS {order_ids}")
+        try:
+            result = self.process_batch(orders) if orders else None
+        except Exception as e:
+            self.logger.log(f"DAEMON: BATCH FAILED - {e}")
+            self.queue.mark_failed(order_ids)
+            return 0
+        # one order going wrong must not hold back the others in its batch
+        failed = {int(order_id) for order_id in getattr(result, "failed", ())}
+        deferred = {
+            int(order_id) for order_id in getattr(result, "deferred", ())
+        } - failed
+        if failed:
+            self.logger.log(f"DAEMON: ORDERS FAILED {sorted(failed)}")
+            self.queue.mark_failed(failed)
+        if deferred:
+            self.logger.log(f"DAEMON: ORDERS DEFERRED {sorted(deferred)}")
+            self.queue.defer(deferred, self.defer_delay)
+        done = [
+            order_id for order_id in order_ids if int(order_id) not in failed | deferred
+        ]
+        self.queue.mark_done(done)
+        return len(done)
+
+    def serve_forever(self):
+        server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        server_thread.start()
+        host, port = self.server.server_address[:2]
+        self.logger.log(f"DAEMON: LISTENING FOR WEBHOOKS ON {host}:{port}")
+        try:
+            while not self._stop.is_set():
+                if (
+                    self._last_poll is None
+                    or time.monotonic() - self._last_poll >= self.poll_interval
+                ):
+                    self.poll()
+                if self.queue.pending_count() == 0:
+                    # sleep until a webhook arrives, the next poll or a retry is due
+                    until_poll = self.poll_interval - (
+                        time.monotonic() - self._last_poll
+                    )
+                    self.wakeup.wait(
+                        timeout=self.queue.seconds_until_due(max(until_poll, 0))
+                    )
+                    self.wakeup.clear()
+                    continue
+                # give webhooks arriving close together a chance to share a batch
+                if self.queue.pending_count() < self.batch_size:
+                    self._stop.wait(self.batch_window)
+                self.run_batch()
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def stop(self):
+        self._stop.set()
+        self.wakeup.set()
@@ -0,0 +1,101 @@
+import openpyxl
+import pandas as pd
+
+from pfsh_parser.catalog_schema import coerce_series
+
+# Supplier master sheet headers and the Matrixify columns they map to
+MATRIXIFY_HEADER_MAP = {
+    "ITEM #": "Metafield: custom.item_number [single_line_text_field]",
+    "MFG UPC": "Variant Barcode",
+    "COO": "Variant Country of Origin",
+    "Weight": "Variant Weight",
+    "Length": "Metafield: custom.length [number_integer]",
+    "Width": "Metafield: custom.width [number_integer]",
+    "Height": "Metafield: custom.height [number_integer]",
+    "SIZE": "Option1 Value",
+    "Case Pack\nSize": "Metafield: custom.case_pack_size [number_integer]",
+    "Case \nWeight\n(LB)": "Metafield: custom.case_weight_pounds [number_integer]",
+    "Case \nLength\n(in)": "Metafield: custom.length_inches [number_integer]",
+    "Case\nHeight\n(in)": "Metafield: custom.height_inches [number_integer]",
+    "Case\nWidth\n(in)": "Metafield: custom.width_inches [number_integer]",
+    "DESCRIPTION": "Title",  # name of product
+    "EXTENDED DESCRIPTION": "Body HTML",  # actual of description of product
+    "KEY FEATURE1": "Metafield: custom.key_feature_1 [single_line_text_field]",
+    "KEY FEATURE2": "Metafield: custom.key_feature_2 [single_line_text_field]",
+    "KEY FEATURE3": "Metafield: custom.key_feature_3 [single_line_text_field]",
+    "SHERALVEN UPC": "Variant SKU [ID]",
+    "Gender Description": "Type",
+    "MSRP": "Variant Price",
+    "DIRECTIONS FOR USE": "Metafield: how_to_use [single_line_text_field]",
+    "Ingredients": "Metafield: custom.ingredients [single_line_text_field]",
+    "Main Picture Link Bottle & Box on White Background": "Image Src",
+    "TOP NOTES": "Metafield: custom.top_notes [single_line_text_field]",
+    "MIDDLE NOTES": "Metafield: custom.middle_notes [single_line_text_field]",
+    "BASE NOTES": "Metafield: custom.base_notes [single_line_text_field]",
+    "SCENT TYPE": "Metafield: custom.scent_type [single_line_text_field]",
+    "YEAR RELEASED": "Metafield: custom.year [number_integer]",
+    "Brand Name": "Vendor",
+}
+
+
+def normalize_header(header) -> str:
+    """Normalize a header so spacing, line breaks and case don't matter when matching."""
+    if header is None:
+        return ""
+    return "".join(str(header).split()).lower()
+
+
+def read_projected_sheet(
+    workbook_file, header_map: dict, sheet_index: int = 0, dtypes: dict = None
+) -> pd.DataFrame:
+    """
+    Stream a worksheet and only keep the columns listed in header_map.
+
+    The workbook is opened in read-only mode so rows are parsed one at a time
+    instead of loading the whole sheet, and headers are matched once with
+    whitespace and embedded newlines ignored.
+
+    Args:
+        workbook_file (str): Path to the xlsx file.
+        header_map (dict): Maps sheet headers to the column names to return.
+        sheet_index (int): Index of the worksheet to read. Defaults to the first sheet.
+        dtypes (Optional[dict]): Catalog dtype for each returned column, keyed by the
+            mapped name. Columns without one are returned as object.
+
+    Returns:
+        pd.DataFrame: The mapped columns, in header_map order.
+    """
+    dtypes = dtypes or {}
+    wanted = {normalize_header(source): target for source, target in header_map.items()}
+    workbook = openpyxl.load_workbook(workbook_file, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[sheet_index]
+        rows = worksheet.iter_rows(values_only=True)
+        header_row = next(rows, ())
+
+        # resolve each mapped header to its position in the sheet
+        positions = {}
+        for index, header in enumerate(header_row):
+            target = wanted.get(normalize_header(header))
+            if target is not None and target not in positions:
+                positions[target] = index
+        columns = [target for target in header_map.values() if target in positions]
+        indexes = [positions[target] for target in columns]
+
+        values = {target: [] for target in columns}
+        for row in rows:
+            if not any(cell is not None for cell in row):
+                continue  # skip blank rows openpyxl reports at the end of the sheet
+            width = len(row)
+            for target, index in zip(columns, indexes):
+                values[target].append(row[index] if index < width else None)
+    finally:
+        workbook.close()
+
+    return pd.DataFrame(
+        {
+            target: coerce_series(values[target], dtypes.get(target))
+            for target in columns
+        },
+        columns=columns,
+    )